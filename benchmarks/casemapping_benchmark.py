@@ -0,0 +1,110 @@
+"""
+Benchmarks RFC casemapping (txircd.utils.ircLower) and CaseInsensitiveDictionary
+lookups against the previous lowercasing implementation and verifies that both
+lowercase strings the same way.
+Run from the base txircd directory:
+python benchmarks/casemapping_benchmark.py
+"""
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from txircd import utils
+from txircd.utils import CaseInsensitiveDictionary, ircLower
+from timeit import default_timer
+import random
+
+def legacyIRCLower(string):
+	"""
+	The lowercasing function as it was before the translation table, kept here
+	as the reference implementation.
+	"""
+	return string.lower().replace("[", "{").replace("]", "}").replace("\\", "|")
+
+def buildCorpus():
+	"""
+	Builds the benchmark corpus as a dict of category name to list of strings.
+	"""
+	rand = random.Random(1459)
+	nickChars = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789[]\\`^{}_|-"
+	def randomString(characters, length):
+		return "".join(rand.choice(characters) for _ in xrange(length))
+	corpus = {}
+	nicks = [randomString(nickChars, rand.randint(3, 16)) for _ in xrange(1000)]
+	channels = ["#{}".format(randomString(nickChars, rand.randint(3, 20))) for _ in xrange(200)]
+	# Lookups mostly hit a set of commonly used names, like nicks and channels do on a real network
+	corpus["nicks"] = [rand.choice(nicks) for _ in xrange(20000)]
+	corpus["channels"] = [rand.choice(channels) for _ in xrange(20000)]
+	# Hostmasks from ban and X-line matching are much less repetitive
+	corpus["hostmasks"] = ["{}!{}@{}.Example.COM".format(rand.choice(nicks), randomString(nickChars, 8), randomString(nickChars, 12)) for _ in xrange(20000)]
+	corpus["all bytes"] = [randomString("".join(chr(i) for i in xrange(256)), rand.randint(0, 30)) for _ in xrange(5000)]
+	return corpus
+
+def timeFunction(function, strings, repeat):
+	bestTime = None
+	for _ in xrange(repeat):
+		startTime = default_timer()
+		for string in strings:
+			function(string)
+		elapsedTime = default_timer() - startTime
+		if bestTime is None or elapsedTime < bestTime:
+			bestTime = elapsedTime
+	return bestTime
+
+class LegacyCaseInsensitiveDictionary(CaseInsensitiveDictionary):
+	"""
+	A CaseInsensitiveDictionary that lowercases its keys the way it used to.
+	"""
+	__slots__ = ()
+
+	def __contains__(self, key):
+		try:
+			self[key]
+		except KeyError:
+			return False
+		return True
+
+	def __getitem__(self, key):
+		try:
+			return self._data[legacyIRCLower(key)]
+		except KeyError:
+			raise KeyError(key)
+
+	def __setitem__(self, key, value):
+		self._data[legacyIRCLower(key)] = value
+
+def main():
+	corpus = buildCorpus()
+	mismatches = 0
+	print "{:<14} {:>8} {:>12} {:>12} {:>8}".format("lowercase", "strings", "legacy (ms)", "new (ms)", "speedup")
+	for category in ("nicks", "channels", "hostmasks", "all bytes"):
+		strings = corpus[category]
+		for string in strings:
+			if legacyIRCLower(string) != ircLower(string):
+				mismatches += 1
+				print "MISMATCH for {!r}:\n  legacy: {!r}\n  new:    {!r}".format(string, legacyIRCLower(string), ircLower(string))
+		legacyTime = timeFunction(legacyIRCLower, strings, 5)
+		newTime = timeFunction(ircLower, strings, 5)
+		print "{:<14} {:>8} {:>12.2f} {:>12.2f} {:>7.2f}x".format(category, len(strings), legacyTime * 1000, newTime * 1000, legacyTime / newTime)
+	print "{:<14} {:>8} {:>12} {:>12} {:>8}".format("lookup", "lookups", "legacy (ms)", "new (ms)", "speedup")
+	for category in ("nicks", "channels"):
+		strings = corpus[category]
+		legacyDict = LegacyCaseInsensitiveDictionary()
+		newDict = CaseInsensitiveDictionary()
+		for string in strings[::2]: # Only some of the names are in the dictionary so that membership tests also miss
+			legacyDict[string] = string
+			newDict[string] = string
+		utils._lowerKeyCache.clear()
+		presentStrings = [string for string in strings if string in newDict]
+		legacyTime = timeFunction(legacyDict.__getitem__, presentStrings, 5)
+		newTime = timeFunction(newDict.__getitem__, presentStrings, 5)
+		print "{:<14} {:>8} {:>12.2f} {:>12.2f} {:>7.2f}x".format(category, len(presentStrings), legacyTime * 1000, newTime * 1000, legacyTime / newTime)
+		legacyTime = timeFunction(legacyDict.__contains__, strings, 5)
+		newTime = timeFunction(newDict.__contains__, strings, 5)
+		print "{:<14} {:>8} {:>12.2f} {:>12.2f} {:>7.2f}x".format("{} (in)".format(category), len(strings), legacyTime * 1000, newTime * 1000, legacyTime / newTime)
+	if mismatches:
+		print "{} strings were lowercased differently!".format(mismatches)
+		sys.exit(1)
+	print "All strings were lowercased identically."
+
+if __name__ == "__main__":
+	main()
\ No newline at end of file
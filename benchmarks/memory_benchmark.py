@@ -0,0 +1,125 @@
+"""
+Measures the memory used by remote users. Creates remote users the way the UID
+server command does, joins each of them to some channels, and reports how much
+the resident memory of the process grew.
+To compare against another version of txircd (such as a checkout from before
+the remote user memory changes), give the base directory of that version, and
+the same benchmark is also run on it in a separate process.
+Run from the base txircd directory:
+python benchmarks/memory_benchmark.py [user count] [channels per user] [baseline directory]
+"""
+import os, sys
+benchmarkDirectory = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.environ.get("TXIRCD_BENCHMARK_TREE", os.path.dirname(benchmarkDirectory)))
+
+from txircd.channel import IRCChannel
+from txircd.ircd import IRCd
+from txircd.server import IRCServer
+from txircd.user import RemoteUser
+from datetime import datetime
+import gc, resource, shutil, subprocess, tempfile
+
+benchmarkConfig = """
+server_name: irc.benchmark.test
+server_id: 1BM
+server_description: Memory benchmark server
+network_name: Benchmark
+datastore_path: {}
+"""
+
+def residentMemory():
+	"""
+	Gets the resident memory of this process in bytes.
+	"""
+	try:
+		with open("/proc/self/status", "r") as statusFile:
+			for line in statusFile:
+				if line.startswith("VmRSS:"):
+					return int(line.split()[1]) * 1024
+	except IOError:
+		pass
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # Falls back to peak usage, which is fine since we only grow
+
+def setUpIRCd(configDirectory):
+	configFileName = os.path.join(configDirectory, "txircd.yaml")
+	with open(configFileName, "w") as configFile:
+		configFile.write(benchmarkConfig.format(os.path.join(configDirectory, "data.db")))
+	ircd = IRCd(configFileName)
+	ircd.config.reload()
+	ircd.name = ircd.config["server_name"]
+	ircd.serverID = ircd.config["server_id"]
+	remoteServer = IRCServer(ircd, "127.0.0.1", True)
+	remoteServer.serverID = "2RM"
+	remoteServer.name = "irc.remote.test"
+	remoteServer.description = "Remote server"
+	remoteServer.register()
+	return ircd, remoteServer
+
+def createUsers(ircd, server, userCount, channelsPerUser):
+	channels = [IRCChannel(ircd, "#channel{}".format(channelNumber)) for channelNumber in xrange(max(1, userCount / 100))]
+	connectTime = datetime.utcnow()
+	for userNumber in xrange(userCount):
+		uuid = "2RM{:06X}".format(userNumber)
+		ip = "10.{}.{}.{}".format((userNumber >> 16) & 255, (userNumber >> 8) & 255, userNumber & 255)
+		user = RemoteUser(ircd, ip, uuid, "host-{}.example.com".format(userNumber))
+		user.changeHost("cloak", "cloak-{}.example.com".format(userNumber), True)
+		user.changeIdent("user{}".format(userNumber), server)
+		user.changeGecos("Benchmark User {}".format(userNumber), True)
+		user.connectedSince = connectTime
+		user.nickSince = connectTime
+		user.changeNick("user{}".format(userNumber), server)
+		user.register("connection", True)
+		user.register("USER", True)
+		user.register("NICK", True)
+		for channelNumber in xrange(channelsPerUser):
+			user.joinChannel(channels[(userNumber + channelNumber * 37) % len(channels)], True, True)
+	return channels
+
+def measureUsers(userCount, channelsPerUser):
+	"""
+	Creates the users in a new IRCd and returns how many bytes the resident
+	memory grew.
+	"""
+	configDirectory = tempfile.mkdtemp()
+	try:
+		ircd, server = setUpIRCd(configDirectory)
+		gc.collect()
+		startMemory = residentMemory()
+		createUsers(ircd, server, userCount, channelsPerUser)
+		gc.collect()
+		return residentMemory() - startMemory
+	finally:
+		shutil.rmtree(configDirectory)
+
+def measureBaseline(baselineDirectory, userCount, channelsPerUser):
+	"""
+	Runs the benchmark on another version of txircd in a separate process and
+	returns how many bytes the resident memory grew.
+	"""
+	environment = os.environ.copy()
+	environment["TXIRCD_BENCHMARK_TREE"] = os.path.realpath(baselineDirectory)
+	output = subprocess.check_output([sys.executable, os.path.realpath(__file__), str(userCount), str(channelsPerUser)], cwd=baselineDirectory, env=environment)
+	return int(output.split()[-1])
+
+def printMemory(label, usedMemory, userCount):
+	print "{:<10} {:>10.1f} MiB {:>10.0f} bytes per user".format(label, usedMemory / 1048576.0, float(usedMemory) / userCount)
+
+def main():
+	userCount = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	channelsPerUser = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+	baselineDirectory = sys.argv[3] if len(sys.argv) > 3 else None
+	usedMemory = measureUsers(userCount, channelsPerUser)
+	if "TXIRCD_BENCHMARK_TREE" in os.environ: # We're measuring the baseline for another run of the benchmark
+		print usedMemory
+		return
+	print "Users:             {}".format(userCount)
+	print "Channels per user: {}".format(channelsPerUser)
+	if baselineDirectory is not None:
+		baselineMemory = measureBaseline(baselineDirectory, userCount, channelsPerUser)
+		printMemory("Baseline:", baselineMemory, userCount)
+	printMemory("Current:", usedMemory, userCount)
+	if baselineDirectory is not None:
+		print "Saved:     {:>10.1f}%".format(100.0 * (baselineMemory - usedMemory) / baselineMemory)
+
+if __name__ == "__main__":
+	main()
\ No newline at end of file
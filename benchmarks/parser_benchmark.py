@@ -0,0 +1,221 @@
+"""
+Benchmarks the IRC line parser in txircd.ircbase against the previous parser
+implementation and verifies that both produce the same results, apart from
+the intended changes in behavior.
+Run from the base txircd directory:
+python benchmarks/parser_benchmark.py
+"""
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from txircd.ircbase import IRCBase
+from timeit import default_timer
+import gc, random
+
+class LegacyParser(object):
+	"""
+	An unchanged copy of the line parser from before the single-pass rewrite,
+	kept here as the reference implementation.
+	"""
+	def _parseLine(self, line):
+		line = line.replace("\0", "")
+		if not line:
+			return None, None, None, None
+		
+		if line[0] == "@":
+			if " " not in line:
+				return None, None, None, None
+			tagLine, line = line.split(" ", 1)
+			tags = self._parseTags(tagLine[1:])
+		else:
+			tags = {}
+		
+		prefix = None
+		if line[0] == ":":
+			if " " not in line:
+				return None, None, None, None
+			prefix, line = line.split(" ", 1)
+			prefix = prefix[1:]
+		
+		if " :" in line:
+			linePart, lastParam = line.split(" :", 1)
+		else:
+			linePart = line
+			lastParam = None
+		if not linePart:
+			return None, None, None, None
+		
+		if " " in linePart:
+			command, paramLine = linePart.split(" ", 1)
+			params = paramLine.split(" ")
+		else:
+			command = linePart
+			params = []
+		while "" in params:
+			params.remove("")
+		if lastParam is not None:
+			params.append(lastParam)
+		return command.upper(), params, prefix, tags
+	
+	def _parseTags(self, tagLine):
+		tags = {}
+		for tagval in tagLine.split(";"):
+			if not tagval:
+				continue
+			if "=" in tagval:
+				tag, escapedValue = tagval.split("=", 1)
+				escaped = False
+				valueChars = []
+				for char in escapedValue:
+					if char == "\\":
+						escaped = True
+						continue
+					if escaped:
+						if char == "\\":
+							valueChars.append("\\")
+						elif char == ":":
+							valueChars.append(";")
+						elif char == "r":
+							valueChars.append("\r")
+						elif char == "n":
+							valueChars.append("\n")
+						elif char == "s":
+							valueChars.append(" ")
+						else:
+							valueChars.append(char)
+						escaped = False
+						continue
+					valueChars.append(char)
+				value = "".join(valueChars)
+			else:
+				tag = tagval
+				value = None
+			tags[tag] = value
+		return tags
+
+def buildCorpus():
+	"""
+	Builds the benchmark corpus as a dict of category name to list of lines.
+	"""
+	rand = random.Random(1459)
+	words = ["hello", "world", "txircd", "lorem", "ipsum", "dolor", ":)", "a:b", "\\o/", "#channel"]
+	def sentence(length):
+		return " ".join(rand.choice(words) for _ in xrange(length))
+	corpus = {}
+	corpus["plain"] = []
+	for i in xrange(2000):
+		corpus["plain"].append("PRIVMSG #chan{} :{}".format(i % 50, sentence(rand.randint(1, 30))))
+		corpus["plain"].append(":nick{0}!ident@host{0}.example.com PRIVMSG #chan :{1}".format(i, sentence(8)))
+		corpus["plain"].append("MODE #chan{} +ov nick{} nick{}".format(i % 50, i, i + 1))
+		corpus["plain"].append("PING :irc.example.com")
+	corpus["tagged"] = []
+	for i in xrange(2000):
+		corpus["tagged"].append("@time=2016-01-01T00:00:{:02d}.000Z :nick!ident@host PRIVMSG #chan :{}".format(i % 60, sentence(10)))
+		corpus["tagged"].append("@account=user{};msgid=abc{};+example.com/tag=value\\swith\\sspaces\\:and\\\\escapes PRIVMSG #chan :{}".format(i, i, sentence(5)))
+		corpus["tagged"].append("@batch=ref{};label=lbl;+draft/reply=\\r\\n\\z :irc.example.com NOTICE nick :{}".format(i, sentence(4)))
+		corpus["tagged"].append("@a;b=;c=\;d=x\\ TAGMSG #chan")
+	corpus["burst"] = []
+	for i in xrange(2000):
+		corpus["burst"].append(":1AA UID 1AAAAA{:03d} 1451606400 nick{} host{}.example.com host{}.example.com ident 127.0.0.{} 1451606400 +ix :Real Name {}".format(i % 1000, i, i, i, i % 256, i))
+		corpus["burst"].append(":1AA FJOIN #chan{} 1451606400 +nt :@1AAAAA{:03d} +1AAAAB{:03d} 1AAAAC{:03d}".format(i, i % 1000, i % 1000, i % 1000))
+		corpus["burst"].append(":1AA METADATA 1AAAAA{:03d} accountname * :user{}".format(i % 1000, i))
+	corpus["malformed"] = []
+	malformed = ["", "\0", "@", "@tags", "@a=b ", ":", ":prefix", ":prefix ", " ", " :", " PRIVMSG", "PRIVMSG  #chan   :hi",
+		":p  CMD", "@a=b  CMD", "cmd :", "CMD\0 #chan\0 :x\0", "@=;=;;= CMD", "@\\=\\ CMD", "CMD :: ::", ":: CMD"]
+	for i in xrange(400):
+		corpus["malformed"].extend(malformed)
+	corpus["flood"] = []
+	for i in xrange(50):
+		corpus["flood"].append("PRIVMSG " + (" " * 4000) + "#chan :x")
+		corpus["flood"].append("MODE #chan +" + ("b" * 500) + " " + ("  x" * 1000))
+		corpus["flood"].append("@" + ";".join("t{}=\\s\\:\\\\".format(j) for j in xrange(400)) + " CMD")
+		corpus["flood"].append(":" + ("p" * 4000) + " CMD " + ("a " * 2000))
+	return corpus
+
+def runParser(parser, lines):
+	results = []
+	for line in lines:
+		try:
+			results.append(parser._parseLine(line))
+		except IndexError: # The legacy parser throws on a line with tags and no command
+			results.append(IndexError)
+	return results
+
+def rawTagValues(line):
+	"""
+	Gets the escaped tag values from a line as a dict of tag name to value.
+	"""
+	if not line.startswith("@") or " " not in line:
+		return {}
+	tagValues = {}
+	for tagval in line[1:line.find(" ")].split(";"):
+		tag, _, value = tagval.partition("=")
+		tagValues[tag] = value
+	return tagValues
+
+def intendedDifference(line, legacyResult, newResult):
+	"""
+	Checks whether a difference between the legacy and new parsers is one of
+	the intended changes, returning a description of the change if so.
+	"""
+	if legacyResult is IndexError and newResult == (None, None, None, None):
+		return "line with tags and no command is ignored instead of raising IndexError"
+	if legacyResult is IndexError or legacyResult[:3] != newResult[:3] or set(legacyResult[3]) != set(newResult[3]):
+		return None
+	rawValues = rawTagValues(line)
+	for tag, value in newResult[3].iteritems():
+		if value != legacyResult[3][tag] and "\\\\" not in rawValues.get(tag, ""):
+			return None
+	return "escaped backslash in a tag value is unescaped to a backslash"
+
+def timeParsers(parsers, lines, repeat):
+	"""
+	Times each parser over the lines, taking the best of repeat runs. The
+	parsers take turns so that changes in the load on the machine affect them
+	equally, and garbage collection is disabled while timing.
+	"""
+	bestTimes = [None] * len(parsers)
+	gcWasEnabled = gc.isenabled()
+	gc.disable()
+	try:
+		for _ in xrange(repeat):
+			for index, parser in enumerate(parsers):
+				startTime = default_timer()
+				runParser(parser, lines)
+				elapsedTime = default_timer() - startTime
+				if bestTimes[index] is None or elapsedTime < bestTimes[index]:
+					bestTimes[index] = elapsedTime
+	finally:
+		if gcWasEnabled:
+			gc.enable()
+	return bestTimes
+
+def main():
+	legacyParser = LegacyParser()
+	newParser = IRCBase()
+	corpus = buildCorpus()
+	mismatches = 0
+	intendedDifferences = {}
+	print "{:<12} {:>8} {:>12} {:>12} {:>8}".format("category", "lines", "legacy (ms)", "new (ms)", "speedup")
+	for category in ("plain", "tagged", "burst", "malformed", "flood"):
+		lines = corpus[category]
+		for line, legacyResult, newResult in zip(lines, runParser(legacyParser, lines), runParser(newParser, lines)):
+			if legacyResult == newResult:
+				continue
+			difference = intendedDifference(line, legacyResult, newResult)
+			if difference is None:
+				mismatches += 1
+				print "MISMATCH for {!r}:\n  legacy: {!r}\n  new:    {!r}".format(line, legacyResult, newResult)
+			else:
+				intendedDifferences[difference] = intendedDifferences.get(difference, 0) + 1
+		legacyTime, newTime = timeParsers((legacyParser, newParser), lines, 20)
+		print "{:<12} {:>8} {:>12.2f} {:>12.2f} {:>7.2f}x".format(category, len(lines), legacyTime * 1000, newTime * 1000, legacyTime / newTime)
+	for difference, count in sorted(intendedDifferences.iteritems()):
+		print "Intended difference ({} lines): {}".format(count, difference)
+	if mismatches:
+		print "{} lines were parsed differently!".format(mismatches)
+		sys.exit(1)
+	print "All other lines were parsed identically."
+
+if __name__ == "__main__":
+	main()
\ No newline at end of file
@@ -1,6 +1,5 @@
 from twisted.words.protocols import irc
 from txircd.utils import CaseInsensitiveDictionary, isValidChannelName, isValidMetadataKey, ModeType, now
-from weakref import WeakKeyDictionary
 
 class IRCChannel(object):
 	def __init__(self, ircd, name):
@@ -8,7 +7,9 @@ class IRCChannel(object):
 			raise InvalidChannelNameError
 		self.ircd = ircd
 		self.name = name[:self.ircd.config.get("channel_name_length", 64)]
-		self.users = WeakKeyDictionary()
+		self.users = {}
+		self.localUsers = set()
+		self.linkUserCounts = {} # Maps each locally-connected server to the number of channel members behind it
 		self.modes = {}
 		self.existedSince = now()
 		self.topic = ""
@@ -29,7 +30,7 @@ class IRCChannel(object):
 			kw["to"] = self.name
 		if kw["to"] is None:
 			del kw["to"]
-		userList = [u for u in self.users.iterkeys() if u.uuid[:3] == self.ircd.serverID]
+		userList = list(self.localUsers)
 		if "skip" in kw:
 			for u in kw["skip"]:
 				if u in userList:
@@ -44,15 +45,14 @@ class IRCChannel(object):
 		if "conditionalTags" in kw:
 			conditionalTags = kw["conditionalTags"]
 			del kw["conditionalTags"]
+		lineCache = {} # Users with the same tags can all be sent the same line
 		for user in userList:
+			tags = baseTags.copy() # Copied so that changes for one user (e.g. batch tags) don't leak to the others
 			if conditionalTags:
-				tags = baseTags.copy()
 				addTags = user.filterConditionalTags(conditionalTags)
 				tags.update(addTags)
-			else:
-				tags = baseTags
 			kw["tags"] = tags
-			user.sendMessage(command, *params, **kw)
+			user.sendCachedMessage(lineCache, command, *params, **kw)
 	
 	def sendServerMessage(self, command, *params, **kw):
 		"""
@@ -64,19 +64,18 @@ class IRCChannel(object):
 		    after we've determined the closest hop of all the servers to which
 		    we're sending
 		"""
-		servers = set()
-		for user in self.users.iterkeys():
-			if user.uuid[:3] != self.ircd.serverID:
-				servers.add(self.ircd.servers[user.uuid[:3]])
 		if "skipall" in kw:
+			servers = set()
+			for user in self.users.iterkeys():
+				if user.uuid[:3] != self.ircd.serverID:
+					servers.add(self.ircd.servers[user.uuid[:3]])
 			for s in kw["skipall"]:
 				servers.discard(s)
-		localServers = set()
-		for server in servers:
-			nearHop = server
-			while nearHop.nextClosest != self.ircd.serverID:
-				nearHop = self.ircd.servers[nearHop.nextClosest]
-			localServers.add(nearHop)
+			localServers = set()
+			for server in servers:
+				localServers.add(self.ircd.serverRoutes[server.serverID][0])
+		else:
+			localServers = set(self.linkUserCounts.iterkeys())
 		if "skiplocal" in kw:
 			for s in kw["skiplocal"]:
 				localServers.discard(s)
@@ -412,10 +411,7 @@ class IRCChannel(object):
 	def _notifyModeChanges(self, modeChanges, source, sourceName):
 		if not modeChanges:
 			return
-		channelUsers = []
-		for user in self.users.iterkeys():
-			if user.uuid[:3] == self.ircd.serverID:
-				channelUsers.append(user)
+		channelUsers = list(self.localUsers)
 		for change in modeChanges:
 			self.ircd.runActionStandard("modechange-channel-{}".format(change[1]), self, change[3], change[0], change[2], channels=[self])
 		self.ircd.runActionProcessing("modemessage-channel", channelUsers, self, source, sourceName, modeChanges, users=channelUsers, channels=[self])
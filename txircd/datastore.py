@@ -0,0 +1,293 @@
+from twisted.internet.threads import deferToThread
+from collections import MutableMapping
+from whichdb import whichdb
+from datetime import date, datetime, time, timedelta
+import cPickle as pickle, os, shelve
+
+_snapshotHeader = "txircd datastore 1\n"
+
+def _isSnapshot(path):
+	if not os.path.exists(path):
+		return False
+	with open(path, "rb") as snapshotFile:
+		return snapshotFile.read(len(_snapshotHeader)) == _snapshotHeader
+
+_unchangingTypes = (basestring, int, long, float, bool, type(None), tuple, frozenset, date, datetime, time, timedelta)
+
+def _mayChangeInPlace(value):
+	"""
+	Checks whether a stored value could be changed in place after it's read,
+	so that reading it has to mark it to be written at the next sync.
+	"""
+	return not isinstance(value, _unchangingTypes)
+
+def _readSnapshot(path):
+	"""
+	Reads the data from a snapshot file. Returns an empty dict if there's no
+	snapshot.
+	"""
+	if not os.path.exists(path):
+		return {}
+	with open(path, "rb") as snapshotFile:
+		if snapshotFile.read(len(_snapshotHeader)) != _snapshotHeader:
+			raise ValueError("{} is not a data storage snapshot".format(path))
+		return pickle.load(snapshotFile)
+
+def _writeSnapshot(path, data):
+	"""
+	Writes the data to a snapshot file, replacing the old snapshot only once
+	the new one is completely written. Returns the size of the snapshot.
+	"""
+	temporaryPath = "{}.tmp".format(path)
+	with open(temporaryPath, "wb") as snapshotFile:
+		snapshotFile.write(_snapshotHeader)
+		pickle.dump(data, snapshotFile, pickle.HIGHEST_PROTOCOL)
+		snapshotFile.flush()
+		os.fsync(snapshotFile.fileno())
+		snapshotSize = snapshotFile.tell()
+	os.rename(temporaryPath, path)
+	return snapshotSize
+
+def _applyRecords(data, records):
+	for record in records:
+		if record[0] == "set":
+			data[record[1]] = record[2]
+		elif record[0] == "delete":
+			data.pop(record[1], None)
+		elif record[1] in data:
+			if record[0] == "setrecord":
+				data[record[1]][record[2]] = record[3]
+			elif record[0] == "deleterecord":
+				data[record[1]].pop(record[2], None)
+
+def _readJournal(path, data):
+	"""
+	Applies the changes in a journal file to the data. Returns False if the
+	end of the journal was cut off, in which case the changes up to there are
+	applied.
+	"""
+	with open(path, "rb") as journalFile:
+		while True:
+			try:
+				records = pickle.load(journalFile)
+			except EOFError:
+				return True
+			except Exception: # A sync that was cut off by a crash leaves a partial batch at the end
+				return False
+			_applyRecords(data, records)
+
+def _compactJournal(snapshotPath, journalPath):
+	"""
+	Writes a new snapshot with the changes from the journal and removes the
+	journal. Only uses the files on disk, so it's safe to run in a thread.
+	Returns the size of the new snapshot.
+	"""
+	data = _readSnapshot(snapshotPath)
+	_readJournal(journalPath, data)
+	snapshotSize = _writeSnapshot(snapshotPath, data)
+	os.remove(journalPath)
+	return snapshotSize
+
+class DataStore(MutableMapping):
+	"""
+	Stores data that persists between runs of the server as a mapping.
+	The data is kept in a snapshot file, and syncing appends the changes since
+	the last sync to a journal file next to it. Top-level values that are
+	dicts are tracked by key, so only the entries that were set, deleted, or
+	read are written. Reading a value only marks it to be written if it could
+	be changed in place, so reading strings and numbers doesn't add to the
+	sync. Once the journal is larger than the snapshot, a new snapshot is
+	written in a thread from the files on disk, so compacting doesn't hold up
+	the server.
+	Data in the old shelve format is converted when it's loaded.
+	"""
+	minimumCompactSize = 1048576
+	
+	def __init__(self, ircd, path):
+		self.ircd = ircd
+		self.path = path
+		self.journalPath = "{}.journal".format(path)
+		self.compactingJournalPath = "{}.journal.compacting".format(path)
+		self._dirtyKeys = set()
+		self._compacting = False
+		rewriteSnapshot = False
+		if not _isSnapshot(path) and whichdb(path):
+			self.ircd.log.info("Converting data storage from the shelve format")
+			shelf = shelve.open(path, "r")
+			data = dict(shelf)
+			shelf.close()
+			rewriteSnapshot = True
+		else:
+			data = _readSnapshot(path)
+		for journalPath in (self.compactingJournalPath, self.journalPath):
+			if os.path.exists(journalPath):
+				if not _readJournal(journalPath, data):
+					self.ircd.log.warn("The data storage journal {path} was cut off; changes in the last sync before the server stopped are lost", path=journalPath)
+				rewriteSnapshot = True
+		if rewriteSnapshot:
+			self._snapshotSize = _writeSnapshot(path, data)
+			for journalPath in (self.compactingJournalPath, self.journalPath):
+				if os.path.exists(journalPath):
+					os.remove(journalPath)
+		elif os.path.exists(path):
+			self._snapshotSize = os.path.getsize(path)
+		else:
+			self._snapshotSize = 0
+		self._data = {}
+		for key, value in data.iteritems():
+			if isinstance(value, dict):
+				value = StoredDict(value)
+			self._data[key] = value
+		self._journalFile = open(self.journalPath, "ab")
+	
+	def __contains__(self, key):
+		return key in self._data
+	
+	def __delitem__(self, key):
+		del self._data[key]
+		self._dirtyKeys.add(key)
+	
+	def __getitem__(self, key):
+		value = self._data[key]
+		if not isinstance(value, StoredDict) and _mayChangeInPlace(value):
+			self._dirtyKeys.add(key)
+		return value
+	
+	def __iter__(self):
+		return iter(self._data)
+	
+	def __len__(self):
+		return len(self._data)
+	
+	def __setitem__(self, key, value):
+		if key in self._data and self._data[key] is value and isinstance(value, StoredDict):
+			return # Changes to it are already tracked
+		if isinstance(value, dict):
+			value = StoredDict(value)
+		self._data[key] = value
+		self._dirtyKeys.add(key)
+	
+	def sync(self):
+		"""
+		Writes the changes since the last sync to the journal.
+		"""
+		records = []
+		for key in self._dirtyKeys:
+			if key not in self._data:
+				records.append(("delete", key))
+				continue
+			value = self._data[key]
+			if isinstance(value, StoredDict):
+				value._dirtyKeys.clear()
+				value = dict(value)
+			records.append(("set", key, value))
+		self._dirtyKeys.clear()
+		for key, value in self._data.iteritems():
+			if not isinstance(value, StoredDict) or not value._dirtyKeys:
+				continue
+			for recordKey in value._dirtyKeys:
+				if recordKey in value:
+					records.append(("setrecord", key, recordKey, dict.__getitem__(value, recordKey)))
+				else:
+					records.append(("deleterecord", key, recordKey))
+			value._dirtyKeys.clear()
+		if not records:
+			return
+		pickle.dump(records, self._journalFile, pickle.HIGHEST_PROTOCOL)
+		self._journalFile.flush()
+		if not self._compacting and self._journalFile.tell() > max(self.minimumCompactSize, self._snapshotSize):
+			self._startCompaction()
+	
+	def close(self):
+		"""
+		Syncs and closes the data storage.
+		"""
+		self.sync()
+		self._journalFile.close()
+	
+	def _startCompaction(self):
+		if os.path.exists(self.compactingJournalPath):
+			return # A compaction failed earlier, and its journal will be applied the next time the data is loaded
+		self._compacting = True
+		self._journalFile.close()
+		os.rename(self.journalPath, self.compactingJournalPath)
+		self._journalFile = open(self.journalPath, "ab")
+		compactDeferred = deferToThread(_compactJournal, self.path, self.compactingJournalPath)
+		compactDeferred.addCallbacks(self._finishCompaction, self._failCompaction)
+	
+	def _finishCompaction(self, snapshotSize):
+		self._compacting = False
+		self._snapshotSize = snapshotSize
+	
+	def _failCompaction(self, failure):
+		self._compacting = False
+		self.ircd.log.failure("An error occurred while compacting the data storage journal", failure)
+
+class StoredDict(dict):
+	"""
+	A dict stored as a top-level value in a DataStore. Keeps track of which of
+	its keys need to be written at the next sync.
+	"""
+	def __init__(self, *args, **kw):
+		dict.__init__(self, *args, **kw)
+		self._dirtyKeys = set()
+	
+	def __delitem__(self, key):
+		dict.__delitem__(self, key)
+		self._dirtyKeys.add(key)
+	
+	def __getitem__(self, key):
+		value = dict.__getitem__(self, key)
+		if _mayChangeInPlace(value):
+			self._dirtyKeys.add(key)
+		return value
+	
+	def __setitem__(self, key, value):
+		dict.__setitem__(self, key, value)
+		self._dirtyKeys.add(key)
+	
+	def _markChangeableValues(self):
+		self._dirtyKeys.update(key for key, value in dict.iteritems(self) if _mayChangeInPlace(value))
+	
+	def clear(self):
+		self._dirtyKeys.update(self)
+		dict.clear(self)
+	
+	def get(self, key, default = None):
+		if key in self:
+			return self[key]
+		return default
+	
+	def items(self):
+		self._markChangeableValues()
+		return dict.items(self)
+	
+	def iteritems(self):
+		self._markChangeableValues()
+		return dict.iteritems(self)
+	
+	def itervalues(self):
+		self._markChangeableValues()
+		return dict.itervalues(self)
+	
+	def pop(self, key, *default):
+		self._dirtyKeys.add(key)
+		return dict.pop(self, key, *default)
+	
+	def popitem(self):
+		key, value = dict.popitem(self)
+		self._dirtyKeys.add(key)
+		return key, value
+	
+	def setdefault(self, key, default = None):
+		if key not in self:
+			self[key] = default
+		return self[key]
+	
+	def update(self, *args, **kw):
+		for key, value in dict(*args, **kw).iteritems():
+			self[key] = value
+	
+	def values(self):
+		self._markChangeableValues()
+		return dict.values(self)
\ No newline at end of file
@@ -1,4 +1,17 @@
 from twisted.protocols.basic import LineOnlyReceiver
+import re
+
+_tagEscapeSequence = re.compile(r"\\(.?)", re.DOTALL) # A backslash at the end of the value is dropped
+_tagUnescapedCharacters = {
+	"\\": "\\",
+	":": ";",
+	"r": "\r",
+	"n": "\n",
+	"s": " "
+}
+def _unescapeTagCharacter(match):
+	char = match.group(1)
+	return _tagUnescapedCharacters.get(char, char)
 
 class IRCBase(LineOnlyReceiver):
 	delimiter = "\n" # Default to splitting by \n, and then we'll also split \r in the handler
@@ -10,41 +23,44 @@ class IRCBase(LineOnlyReceiver):
 				self.handleCommand(command, params, prefix, tags)
 	
 	def _parseLine(self, line):
-		line = line.replace("\0", "")
+		if "\0" in line:
+			line = line.replace("\0", "")
 		if not line:
 			return None, None, None, None
 		
 		if line[0] == "@":
-			if " " not in line:
+			tagEnd = line.find(" ")
+			if tagEnd == -1:
+				return None, None, None, None
+			tags = self._parseTags(line[1:tagEnd])
+			line = line[tagEnd + 1:]
+			if not line:
 				return None, None, None, None
-			tagLine, line = line.split(" ", 1)
-			tags = self._parseTags(tagLine[1:])
 		else:
 			tags = {}
 		
 		prefix = None
 		if line[0] == ":":
-			if " " not in line:
+			prefixEnd = line.find(" ")
+			if prefixEnd == -1:
 				return None, None, None, None
-			prefix, line = line.split(" ", 1)
-			prefix = prefix[1:]
+			prefix = line[1:prefixEnd]
+			line = line[prefixEnd + 1:]
 		
-		if " :" in line:
-			linePart, lastParam = line.split(" :", 1)
-		else:
-			linePart = line
+		lastParamStart = line.find(" :")
+		if lastParamStart == -1:
 			lastParam = None
-		if not linePart:
+		else:
+			lastParam = line[lastParamStart + 2:]
+			line = line[:lastParamStart]
+		if not line:
 			return None, None, None, None
 		
-		if " " in linePart:
-			command, paramLine = linePart.split(" ", 1)
-			params = paramLine.split(" ")
-		else:
-			command = linePart
-			params = []
-		while "" in params:
-			params.remove("")
+		params = line.split(" ")
+		command = params[0]
+		del params[0]
+		if "" in params: # Only lines with repeated spaces have empty parameters to drop
+			params = filter(None, params)
 		if lastParam is not None:
 			params.append(lastParam)
 		return command.upper(), params, prefix, tags
@@ -54,34 +70,11 @@ class IRCBase(LineOnlyReceiver):
 		for tagval in tagLine.split(";"):
 			if not tagval:
 				continue
-			if "=" in tagval:
-				tag, escapedValue = tagval.split("=", 1)
-				escaped = False
-				valueChars = []
-				for char in escapedValue:
-					if char == "\\":
-						escaped = True
-						continue
-					if escaped:
-						if char == "\\":
-							valueChars.append("\\")
-						elif char == ":":
-							valueChars.append(";")
-						elif char == "r":
-							valueChars.append("\r")
-						elif char == "n":
-							valueChars.append("\n")
-						elif char == "s":
-							valueChars.append(" ")
-						else:
-							valueChars.append(char)
-						escaped = False
-						continue
-					valueChars.append(char)
-				value = "".join(valueChars)
-			else:
-				tag = tagval
+			tag, hasValue, value = tagval.partition("=")
+			if not hasValue:
 				value = None
+			elif "\\" in value:
+				value = _tagEscapeSequence.sub(_unescapeTagCharacter, value)
 			tags[tag] = value
 		return tags
 	
@@ -89,6 +82,9 @@ class IRCBase(LineOnlyReceiver):
 		pass
 	
 	def sendMessage(self, command, *params, **kw):
+		self.sendLine(self._formatMessage(command, params, kw))
+	
+	def _formatMessage(self, command, params, kw):
 		if "tags" in kw:
 			tags = self._buildTagString(kw["tags"])
 		else:
@@ -118,7 +114,7 @@ class IRCBase(LineOnlyReceiver):
 		if prefix:
 			lineToSend += ":{} ".format(prefix)
 		lineToSend += "{} {}".format(command, " ".join(params))
-		self.sendLine(lineToSend.replace("\0", ""))
+		return lineToSend.replace("\0", "")
 	
 	def _buildTagString(self, tags):
 		tagList = []
@@ -136,4 +132,28 @@ class IRCBase(LineOnlyReceiver):
 		return ";".join(tagList)
 	
 	def sendLine(self, line):
-		return self.transport.write("{}\r\n".format(line))
\ No newline at end of file
+		"""
+		Queues a line to be sent. Lines are collected and written together at
+		the end of the current reactor iteration, or as soon as the amount
+		queued reaches the output flush size.
+		"""
+		line = "{}\r\n".format(line)
+		self._outputBuffer.append(line)
+		self._outputBufferSize += len(line)
+		if self._outputBufferSize >= self._outputFlushSize:
+			self.flushOutput()
+		elif len(self._outputBuffer) == 1: # This is the first line queued since the last flush
+			self.ircd.queueOutputFlush(self)
+	
+	def flushOutput(self):
+		"""
+		Writes all queued lines to the transport. This should be called before
+		closing the connection so that no queued lines are lost.
+		"""
+		if not self._outputBuffer:
+			return
+		outputLines = self._outputBuffer
+		self._outputBuffer = []
+		self._outputBufferSize = 0
+		if self.transport:
+			self.transport.writeSequence(outputLines)
\ No newline at end of file
@@ -7,12 +7,17 @@ from twisted.logger import FilteringLogObserver, globalLogPublisher, InvalidLogL
 from twisted.plugin import getPlugins
 from twisted.python.rebuild import rebuild
 from txircd.config import Config, ConfigError, ConfigValidationError
+from txircd.datastore import DataStore
 from txircd.factory import ServerConnectFactory, ServerListenFactory, UserFactory
 from txircd.module_interface import ICommand, IMode, IModuleData
+from txircd.resolver import HostResolver
+from txircd.timerwheel import TimerWheel
+from txircd.timing import TimingStats
+from txircd.userindex import LocalUserIndex
 from txircd.utils import CaseInsensitiveDictionary, ModeType, now, unescapeEndpointDescription
 from datetime import timedelta
-from weakref import WeakValueDictionary
-import importlib, random, re, shelve, string, txircd.modules
+from functools import partial
+import heapq, importlib, random, re, string, txircd.modules
 
 class IRCd(Service):
 	def __init__(self, configFileName):
@@ -33,10 +38,18 @@ class IRCd(Service):
 		self.userModes = ({}, {}, {}, {})
 		self.userModeTypes = {}
 		self.actions = {}
+		self._actionPlans = {}
+		self._comboActionPlans = {}
+		self._modeActionIndex = {}
 		self.storage = None
 		self.storageSyncer = None
 		self.dataCache = {}
 		self.functionCache = {}
+		self.timingStats = None
+		self.hostResolver = HostResolver(self)
+		self.timerWheel = TimerWheel(self)
+		self._pendingOutputConnections = set()
+		self._pendingOutputFlushCall = None
 		
 		self.serverID = None
 		self.name = None
@@ -47,15 +60,20 @@ class IRCd(Service):
 		self._uid = self._genUID()
 		
 		self.users = {}
+		self.localUsers = {}
+		self.localUserIndex = LocalUserIndex()
+		self.usersByServer = {}
 		self.userNicks = CaseInsensitiveDictionary()
-		self.channels = CaseInsensitiveDictionary(WeakValueDictionary)
+		self.channels = CaseInsensitiveDictionary()
 		self.servers = {}
 		self.serverNames = CaseInsensitiveDictionary()
+		self.serverRoutes = {} # Maps each server ID to (locally-connected server toward it, hop count)
 		self.recentlyQuitUsers = {}
 		self.recentlyQuitServers = {}
 		self.recentlyDestroyedChannels = CaseInsensitiveDictionary()
 		self.pruneRecentlyQuit = None
 		self.pruneRecentChannels = None
+		self.pruneHostCache = None
 		
 		self._logFilter = LogLevelFilterPredicate()
 		filterObserver = FilteringLogObserver(globalLogPublisher, (self._logFilter,))
@@ -70,15 +88,19 @@ class IRCd(Service):
 		self.config.reload()
 		self.name = self.config["server_name"]
 		self.serverID = self.config["server_id"]
+		self._setUpTimingStats()
 		self.log.info("Loading storage...")
-		self.storage = shelve.open(self.config["datastore_path"], writeback=True)
+		self.storage = DataStore(self, self.config["datastore_path"])
 		self.storageSyncer = LoopingCall(self.storage.sync)
 		self.storageSyncer.start(self.config.get("storage_sync_interval", 5), now=False)
 		self.log.info("Starting processes...")
+		self.timerWheel.start()
 		self.pruneRecentlyQuit = LoopingCall(self.pruneQuit)
 		self.pruneRecentlyQuit.start(10, now=False)
 		self.pruneRecentChannels = LoopingCall(self.pruneChannels)
 		self.pruneRecentChannels.start(15, now=False)
+		self.pruneHostCache = LoopingCall(self.hostResolver.pruneCache)
+		self.pruneHostCache.start(60, now=False)
 		self.log.info("Loading modules...")
 		self._loadModules()
 		self.log.info("Binding ports...")
@@ -95,20 +117,24 @@ class IRCd(Service):
 		self.log.info("Disconnecting servers...")
 		serverList = self.servers.values() # Take the list of server objects
 		self.servers = {} # And then destroy the server dict to inhibit server objects generating lots of noise
+		self.serverRoutes = {}
 		for server in serverList:
 			if server.nextClosest == self.serverID:
 				stopDeferreds.append(server.disconnectedDeferred)
-				allUsers = self.users.keys()
-				for user in allUsers:
-					if user[:3] == server.serverID:
-						del self.users[user]
+				if server.serverID in self.usersByServer:
+					for user in self.usersByServer[server.serverID]:
+						del self.users[user.uuid]
+				server.flushOutput()
 				server.transport.loseConnection()
 		self.log.info("Disconnecting users...")
 		userList = self.users.values() # Basically do the same thing I just did with the servers
 		self.users = {}
+		self.localUsers = {}
+		self.usersByServer = {}
 		for user in userList:
 			if user.transport:
 				stopDeferreds.append(user.disconnectedDeferred)
+				user.flushOutput()
 				user.transport.loseConnection()
 		self.log.info("Unloading modules...")
 		moduleList = self.loadedModules.keys()
@@ -119,6 +145,9 @@ class IRCd(Service):
 			self.pruneRecentlyQuit.stop()
 		if self.pruneRecentChannels.running:
 			self.pruneRecentChannels.stop()
+		if self.pruneHostCache.running:
+			self.pruneHostCache.stop()
+		self.timerWheel.stop()
 		self.log.info("Closing data storage...")
 		if self.storageSyncer.running:
 			self.storageSyncer.stop()
@@ -263,6 +292,9 @@ class IRCd(Service):
 			for mode, implementation in typeSet.iteritems():
 				self.userModeTypes[mode] = modeType
 				self.userModes[modeType][mode] = implementation
+		if newActions:
+			self._actionPlans = {}
+			self._comboActionPlans = {}
 		for action, actionList in newActions.iteritems():
 			if action not in self.actions:
 				self.actions[action] = []
@@ -293,6 +325,7 @@ class IRCd(Service):
 						break
 				else:
 					self.serverCommands[command].append(data)
+		self._rebuildModeActionIndex()
 		
 		self.log.debug("Module {module.name} is now fully loaded.", module=module)
 	
@@ -365,6 +398,9 @@ class IRCd(Service):
 			
 			del self.userModes[modeData[1]][modeData[0]]
 			del self.userModeTypes[modeData[0]]
+		if moduleData["actions"]:
+			self._actionPlans = {}
+			self._comboActionPlans = {}
 		for actionData in moduleData["actions"]:
 			self.actions[actionData[0]].remove((actionData[2], actionData[1]))
 			if not self.actions[actionData[0]]:
@@ -377,6 +413,7 @@ class IRCd(Service):
 			self.serverCommands[commandData[0]].remove((commandData[2], commandData[1]))
 			if not self.serverCommands[commandData[0]]:
 				del self.serverCommands[commandData[0]]
+		self._rebuildModeActionIndex()
 		
 		del self.loadedModules[moduleName]
 		del self._loadedModuleData[moduleName]
@@ -490,6 +527,10 @@ class IRCd(Service):
 			config["datastore_path"] = "data.db"
 		if "storage_sync_interval" in config and not isinstance(config["storage_sync_interval"], int):
 			raise ConfigValidationError(config["storage_sync_interval"], "invalid number")
+		if "timing_stats" in config and not isinstance(config["timing_stats"], bool):
+			raise ConfigValidationError("timing_stats", "value must be a boolean")
+		if "timing_stats_sample_rate" in config and (not isinstance(config["timing_stats_sample_rate"], int) or config["timing_stats_sample_rate"] < 1):
+			raise ConfigValidationError("timing_stats_sample_rate", "invalid number")
 
 		# Channels
 		if "channel_name_length" in config:
@@ -520,6 +561,14 @@ class IRCd(Service):
 				self.logConfigValidationWarning("user_registration_timeout", "timeout could be too short for clients to register in time", 10)
 		if "user_ping_frequency" in config and (not isinstance(config["user_ping_frequency"], int) or config["user_ping_frequency"] < 0):
 			raise ConfigValidationError("user_ping_frequency", "invalid number")
+		if "dns_timeout" in config and (not isinstance(config["dns_timeout"], int) or config["dns_timeout"] < 0):
+			raise ConfigValidationError("dns_timeout", "invalid number")
+		if "dns_concurrent_lookups" in config and (not isinstance(config["dns_concurrent_lookups"], int) or config["dns_concurrent_lookups"] < 1):
+			raise ConfigValidationError("dns_concurrent_lookups", "invalid number")
+		if "dns_cache_time" in config and (not isinstance(config["dns_cache_time"], int) or config["dns_cache_time"] < 0):
+			raise ConfigValidationError("dns_cache_time", "invalid number")
+		if "dns_negative_cache_time" in config and (not isinstance(config["dns_negative_cache_time"], int) or config["dns_negative_cache_time"] < 0):
+			raise ConfigValidationError("dns_negative_cache_time", "invalid number")
 		if "hostname_length" in config:
 			if not isinstance(config["hostname_length"], int) or config["hostname_length"] < 0:
 				raise ConfigValidationError("hostname_length", "invalid number")
@@ -563,6 +612,8 @@ class IRCd(Service):
 				self.logConfigValidationWarning("server_registration_timeout", "timeout could be too short for servers to register in time", 10)
 		if "server_ping_frequency" in config and (not isinstance(config["server_ping_frequency"], int) or config["server_ping_frequency"] < 0):
 			raise ConfigValidationError("server_ping_frequency", "invalid number")
+		if "output_flush_size" in config and (not isinstance(config["output_flush_size"], int) or config["output_flush_size"] < 0):
+			raise ConfigValidationError("output_flush_size", "invalid number")
 
 		for module in self.loadedModules.itervalues():
 			module.verifyConfig(config)
@@ -587,9 +638,21 @@ class IRCd(Service):
 		except (KeyError, InvalidLogLevelError):
 			pass # If we can't set a new log level, we'll keep the old one
 		
+		self._setUpTimingStats()
+		
 		for module in self.loadedModules.itervalues():
 			module.rehash()
 	
+	def _setUpTimingStats(self):
+		if not self.config.get("timing_stats", False):
+			self.timingStats = None
+			return
+		sampleRate = self.config.get("timing_stats_sample_rate", 100)
+		if self.timingStats is None:
+			self.timingStats = TimingStats(sampleRate)
+		else:
+			self.timingStats.sampleRate = sampleRate # Keep the data we've collected so far
+	
 	def _bindPorts(self):
 		for bindDesc in self.config["bind_client"]:
 			try:
@@ -667,12 +730,11 @@ class IRCd(Service):
 			del self.recentlyQuitServers[serverID]
 	
 	def pruneChannels(self):
+		compareTime = now() - timedelta(seconds=15)
 		removeChannels = []
-		for channel, remove in self.recentlyDestroyedChannels.iteritems():
-			if remove:
+		for channel, timeDestroyed in self.recentlyDestroyedChannels.iteritems():
+			if timeDestroyed < compareTime:
 				removeChannels.append(channel)
-			elif channel not in self.channels:
-				self.recentlyDestroyedChannels[channel] = True
 		for channel in removeChannels:
 			del self.recentlyDestroyedChannels[channel]
 	
@@ -725,7 +787,85 @@ class IRCd(Service):
 			if server.nextClosest == self.serverID and server != fromServer:
 				server.sendMessage(command, *params, **kw)
 	
+	def queueOutputFlush(self, connection):
+		"""
+		Marks a user or server connection as having queued output. The output
+		of all marked connections is written together at the end of the current
+		reactor iteration, so only one call is scheduled however many
+		connections have output.
+		"""
+		self._pendingOutputConnections.add(connection)
+		if self._pendingOutputFlushCall is None:
+			self._pendingOutputFlushCall = reactor.callLater(0, self._flushPendingOutput)
+	
+	def _flushPendingOutput(self):
+		self._pendingOutputFlushCall = None
+		pendingConnections = self._pendingOutputConnections
+		self._pendingOutputConnections = set()
+		for connection in pendingConnections:
+			connection.flushOutput()
+	
+	def _rebuildModeActionIndex(self):
+		"""
+		Rebuilds the index of which modes affect which actions, along with the
+		check chains used to determine whether each mode applies to a target.
+		This must be done whenever modes or action handlers change.
+		"""
+		modeActionIndex = {}
+		for modeType in self.userModes:
+			for mode, modeObj in modeType.iteritems():
+				for actionName in modeObj.affectedActions:
+					if actionName not in modeActionIndex:
+						modeActionIndex[actionName] = ([], [])
+					checkChain = self._buildModeCheckChain("user", "withchannel", mode, actionName)
+					modeActionIndex[actionName][0].append((modeObj, modeObj.affectedActions[actionName], checkChain))
+		for modeType in self.channelModes:
+			for mode, modeObj in modeType.iteritems():
+				for actionName in modeObj.affectedActions:
+					if actionName not in modeActionIndex:
+						modeActionIndex[actionName] = ([], [])
+					checkChain = self._buildModeCheckChain("channel", "withuser", mode, actionName)
+					modeActionIndex[actionName][1].append((modeObj, modeObj.affectedActions[actionName], checkChain))
+		self._modeActionIndex = modeActionIndex
+	
+	def _buildModeCheckChain(self, targetType, withType, mode, actionName):
+		# Each check in the chain is (function, priority, leadingParams, takesOtherTarget).
+		# The leading parameters are passed before the target; checks that take the other
+		# target (the channel for user modes or the user for channel modes) are called once
+		# for each of those.
+		checkChain = []
+		for action in self.actions.get("modeactioncheck-{}-{}-{}".format(targetType, mode, actionName), []):
+			checkChain.append((action[0], action[1], (), False))
+		for action in self.actions.get("modeactioncheck-{}".format(targetType), []):
+			checkChain.append((action[0], action[1], (actionName, mode), False))
+		for action in self.actions.get("modeactioncheck-{}-{}".format(targetType, withType), []):
+			checkChain.append((action[0], action[1], (actionName, mode), True))
+		for action in self.actions.get("modeactioncheck-{}-{}".format(targetType, actionName), []):
+			checkChain.append((action[0], action[1], (mode,), False))
+		for action in self.actions.get("modeactioncheck-{}-{}-{}".format(targetType, withType, actionName), []):
+			checkChain.append((action[0], action[1], (mode,), True))
+		for action in self.actions.get("modeactioncheck-{}-{}-{}-{}".format(targetType, withType, mode, actionName), []):
+			checkChain.append((action[0], action[1], (), True))
+		checkChain.sort(key=lambda check: check[1], reverse=True)
+		return checkChain
+	
+	def _checkModeParameter(self, checkChain, target, otherTargets, params):
+		for checkFunction, priority, leadingParams, takesOtherTarget in checkChain:
+			if takesOtherTarget:
+				for otherTarget in otherTargets:
+					param = checkFunction(*(leadingParams + (target, otherTarget) + params))
+					if param is not None:
+						return param
+			else:
+				param = checkFunction(*(leadingParams + (target,) + params))
+				if param is not None:
+					return param
+		return None
+	
 	def _getActionModes(self, actionName, *params, **kw):
+		if actionName not in self._modeActionIndex:
+			return []
+		userModeData, channelModeData = self._modeActionIndex[actionName]
 		users = []
 		channels = []
 		if "users" in kw:
@@ -736,105 +876,112 @@ class IRCd(Service):
 		functionList = []
 		
 		if users:
-			genericUserActionName = "modeactioncheck-user-{}".format(actionName)
-			genericUserActionNameWithChannel = "modeactioncheck-user-withchannel-{}".format(actionName)
-			for modeType in self.userModes:
-				for mode, modeObj in modeType.iteritems():
-					if actionName not in modeObj.affectedActions:
-						continue
-					priority = modeObj.affectedActions[actionName]
-					actionList = []
-					# Because Python doesn't properly capture variables in lambdas, we have to force static capture
-					# by wrapping lambdas in more lambdas.
-					# I wish Python wasn't this gross.
-					for action in self.actions.get("modeactioncheck-user", []):
-						actionList.append(((lambda action, actionName, mode: lambda user, *params: action[0](actionName, mode, user, *params))(action, actionName, mode), action[1]))
-					for action in self.actions.get("modeactioncheck-user-withchannel", []):
-						for channel in channels:
-							actionList.append(((lambda action, actionName, mode, channel: lambda user, *params: action[0](actionName, mode, user, channel, *params))(action, actionName, mode, channel), action[1]))
-					for action in self.actions.get(genericUserActionName, []):
-						actionList.append(((lambda action, mode: lambda user, *params: action[0](mode, user, *params))(action, mode), action[1]))
-					for action in self.actions.get(genericUserActionNameWithChannel, []):
-						for channel in channels:
-							actionList.append(((lambda action, mode, channel: lambda user, *params: action[0](mode, user, channel, *params))(action, mode, channel), action[1]))
-					modeUserActionName = "modeactioncheck-user-{}-{}".format(mode, actionName)
-					modeUserActionNameWithChannel = "modeactioncheck-user-withchannel-{}-{}".format(mode, actionName)
-					for action in self.actions.get(modeUserActionNameWithChannel, []):
-						for channel in channels:
-							actionList.append(((lambda action, channel: lambda user, *params: action[0](user, channel, *params))(action, channel), action[1]))
-					actionList = sorted(self.actions.get(modeUserActionName, []) + actionList, key=lambda action: action[1], reverse=True)
-					applyUsers = []
-					for user in users:
-						for action in actionList:
-							param = action[0](user, *params)
-							if param is not None:
-								if param is not False:
-									applyUsers.append((user, param))
-								break
-					for user, param in applyUsers:
-						functionList.append(((lambda modeObj, actionName, user, param: lambda *params: modeObj.apply(actionName, user, param, *params))(modeObj, actionName, user, param), priority))
+			for modeObj, priority, checkChain in userModeData:
+				for user in users:
+					param = self._checkModeParameter(checkChain, user, channels, params)
+					if param is not None and param is not False:
+						functionList.append((partial(modeObj.apply, actionName, user, param), priority))
 		
 		if channels:
-			genericChannelActionName = "modeactioncheck-channel-{}".format(actionName)
-			genericChannelActionNameWithUser = "modeactioncheck-channel-withuser-{}".format(actionName)
-			for modeType in self.channelModes:
-				for mode, modeObj in modeType.iteritems():
-					if actionName not in modeObj.affectedActions:
-						continue
-					priority = modeObj.affectedActions[actionName]
-					actionList = []
-					for action in self.actions.get("modeactioncheck-channel", []):
-						actionList.append(((lambda action, actionName, mode: lambda channel, *params: action[0](actionName, mode, channel, *params))(action, actionName, mode), action[1]))
-					for action in self.actions.get("modeactioncheck-channel-withuser", []):
-						for user in users:
-							actionList.append(((lambda action, actionName, mode, user: lambda channel, *params: action[0](actionName, mode, channel, user, *params))(action, actionName, mode, user), action[1]))
-					for action in self.actions.get(genericChannelActionName, []):
-						actionList.append(((lambda action, mode: lambda channel, *params: action[0](mode, channel, *params))(action, mode), action[1]))
-					for action in self.actions.get(genericChannelActionNameWithUser, []):
-						for user in users:
-							actionList.append(((lambda action, mode, user: lambda channel, *params: action[0](mode, channel, user, *params))(action, mode, user), action[1]))
-					modeChannelActionName = "modeactioncheck-channel-{}-{}".format(mode, actionName)
-					modeChannelActionNameWithUser = "modeactioncheck-channel-withuser-{}-{}".format(mode, actionName)
-					for action in self.actions.get(modeChannelActionNameWithUser, []):
-						for user in users:
-							actionList.append(((lambda action, user: lambda channel, *params: action[0](channel, user, *params))(action, user), action[1]))
-					actionList = sorted(self.actions.get(modeChannelActionName, []) + actionList, key=lambda action: action[1], reverse=True)
-					applyChannels = []
-					for channel in channels:
-						for action in actionList:
-							param = action[0](channel, *params)
-							if param is not None:
-								if param is not False:
-									applyChannels.append((channel, param))
-								break
-					for channel, param in applyChannels:
-						functionList.append(((lambda modeObj, actionName, channel, param: lambda *params: modeObj.apply(actionName, channel, param, *params))(modeObj, actionName, channel, param), priority))
+			for modeObj, priority, checkChain in channelModeData:
+				for channel in channels:
+					param = self._checkModeParameter(checkChain, channel, users, params)
+					if param is not None and param is not False:
+						functionList.append((partial(modeObj.apply, actionName, channel, param), priority))
 		return functionList
 	
+	def _getActionPlan(self, actionName):
+		"""
+		Gets the cached list of handlers for the given action in priority order.
+		The cache is cleared whenever module loading or unloading changes the
+		set of action handlers, so the list is only sorted once per action.
+		"""
+		try:
+			return self._actionPlans[actionName]
+		except KeyError:
+			plan = sorted(self.actions.get(actionName, []), key=lambda action: action[1], reverse=True)
+			self._actionPlans[actionName] = plan
+			return plan
+	
 	def _getActionFunctionList(self, actionName, *params, **kw):
-		functionList = self.actions.get(actionName, [])
-		functionList = functionList + self._getActionModes(actionName, *params, **kw)
-		return sorted(functionList, key=lambda action: action[1], reverse=True)
+		functionList = self._mergeModeFunctions(self._getActionPlan(actionName), self._getActionModes(actionName, *params, **kw))
+		if self.timingStats is not None:
+			return self.timingStats.timedFunctionList(actionName, functionList)
+		return functionList
+	
+	def _mergeModeFunctions(self, actionPlan, modeFunctions):
+		if not modeFunctions:
+			return actionPlan
+		modeFunctions.sort(key=lambda action: action[1], reverse=True)
+		# Merge the mode handlers into the already-sorted plan. Action handlers go
+		# before mode handlers of the same priority, as they did with a stable sort.
+		functionList = []
+		planIndex = 0
+		planLength = len(actionPlan)
+		for modeFunction in modeFunctions:
+			while planIndex < planLength and actionPlan[planIndex][1] >= modeFunction[1]:
+				functionList.append(actionPlan[planIndex])
+				planIndex += 1
+			functionList.append(modeFunction)
+		functionList.extend(actionPlan[planIndex:])
+		return functionList
 	
 	def _combineActionFunctionLists(self, actionLists):
 		"""
 		Combines multiple lists of action functions into one.
 		Assumes all lists are sorted.
-		Takes a dict mapping action names to their action function lists.
+		Takes a list of (actionName, actionFunctionList) tuples; functions of the
+		same priority are kept in the order their actions were given.
 		Returns a list in priority order (highest to lowest) of (actionName, function) tuples.
 		"""
-		fullActionList = []
-		for actionName, actionList in actionLists.iteritems():
-			insertPos = 0
-			for action in actionList:
-				try:
-					while fullActionList[insertPos][1] > action[1]:
-						insertPos += 1
-					fullActionList.insert(insertPos, (actionName, action[0]))
-				except IndexError:
-					fullActionList.append((actionName, action[0]))
-				insertPos += 1
-		return fullActionList
+		sortableLists = []
+		for listIndex, actionData in enumerate(actionLists):
+			actionName, actionList = actionData
+			# The list and item indices keep the ordering stable and ensure functions never get compared.
+			sortableLists.append([(-action[1], listIndex, itemIndex, actionName, action[0]) for itemIndex, action in enumerate(actionList)])
+		return [(action[3], action[4]) for action in heapq.merge(*sortableLists)]
+	
+	def _getComboActionPlan(self, actionNames):
+		"""
+		Gets the cached combined function list for the given tuple of action
+		names. Like the individual action plans, these are cleared when module
+		loading or unloading changes the action handlers.
+		"""
+		try:
+			return self._comboActionPlans[actionNames]
+		except KeyError:
+			comboPlan = self._combineActionFunctionLists([(actionName, self._getActionPlan(actionName)) for actionName in actionNames])
+			self._comboActionPlans[actionNames] = comboPlan
+			return comboPlan
+	
+	def _getComboActionFunctionList(self, actionList, leadingParams, **kw):
+		"""
+		Gets the combined function list for the actions in a combo action call.
+		The leadingParams are passed to every action before the action's own
+		parameters.
+		Returns a list in priority order of (actionName, function) tuples and a
+		dict mapping each action name to its parameters.
+		"""
+		actionNames = []
+		actionParameters = {}
+		modeFunctionLists = {}
+		for action in actionList:
+			parameters = leadingParams + tuple(action[1:])
+			actionNames.append(action[0])
+			actionParameters[action[0]] = parameters
+			modeFunctions = self._getActionModes(action[0], *parameters, **kw)
+			if modeFunctions:
+				modeFunctionLists[action[0]] = modeFunctions
+		if modeFunctionLists:
+			actionFuncLists = []
+			for actionName in actionNames:
+				actionFuncLists.append((actionName, self._mergeModeFunctions(self._getActionPlan(actionName), modeFunctionLists.get(actionName))))
+			funcList = self._combineActionFunctionLists(actionFuncLists)
+		else:
+			funcList = self._getComboActionPlan(tuple(actionNames))
+		if self.timingStats is not None:
+			funcList = self.timingStats.timedComboFunctionList(actionNames, funcList)
+		return funcList, actionParameters
 	
 	def runActionStandard(self, actionName, *params, **kw):
 		"""
@@ -956,13 +1103,7 @@ class IRCd(Service):
 		Accepts 'users' and 'channels' keyword arguments to determine which
 		mode handlers should be included.
 		"""
-		actionFuncLists = {}
-		actionParameters = {}
-		for action in actionList:
-			parameters = action[1:]
-			actionParameters[action[0]] = parameters
-			actionFuncLists[action[0]] = self._getActionFunctionList(action[0], *parameters, **kw)
-		funcList = self._combineActionFunctionLists(actionFuncLists)
+		funcList, actionParameters = self._getComboActionFunctionList(actionList, (), **kw)
 		for actionName, actionFunc in funcList:
 			actionFunc(*actionParameters[actionName])
 	
@@ -976,13 +1117,7 @@ class IRCd(Service):
 		'users' and 'channels' keyword arguments to determine which mode
 		handlers should be included.
 		"""
-		actionFuncLists = {}
-		actionParameters = {}
-		for action in actionList:
-			parameters = action[1:]
-			actionParameters[action[0]] = parameters
-			actionFuncLists[action[0]] = self._getActionFunctionList(action[0], *parameters, **kw)
-		funcList = self._combineActionFunctionLists(actionFuncLists)
+		funcList, actionParameters = self._getComboActionFunctionList(actionList, (), **kw)
 		for actionName, actionFunc in funcList:
 			if actionFunc(*actionParameters[actionName]):
 				return True
@@ -998,13 +1133,7 @@ class IRCd(Service):
 		'users' and 'channels' keyword arguments to determine which mode
 		handlers should be included.
 		"""
-		actionFuncLists = {}
-		actionParameters = {}
-		for action in actionList:
-			parameters = action[1:]
-			actionParameters[action[0]] = parameters
-			actionFuncLists[action[0]] = self._getActionFunctionList(action[0], *parameters, **kw)
-		funcList = self._combineActionFunctionLists(actionFuncLists)
+		funcList, actionParameters = self._getComboActionFunctionList(actionList, (), **kw)
 		for actionName, actionFunc in funcList:
 			if not actionFunc(*actionParameters[actionName]):
 				return True
@@ -1020,13 +1149,7 @@ class IRCd(Service):
 		value. Accepts 'users' and 'channels' keyword arguments to determine
 		which mode handlers should be included.
 		"""
-		actionFuncLists = {}
-		actionParameters = {}
-		for action in actionList:
-			parameters = action[1:]
-			actionParameters[action[0]] = parameters
-			actionFuncLists[action[0]] = self._getActionFunctionList(action[0], *parameters, **kw)
-		funcList = self._combineActionFunctionLists(actionFuncLists)
+		funcList, actionParameters = self._getComboActionFunctionList(actionList, (), **kw)
 		for actionName, actionFunc in funcList:
 			value = actionFunc(*actionParameters[actionName])
 			if value is not None:
@@ -1042,13 +1165,7 @@ class IRCd(Service):
 		Accepts 'users' and 'channels' keyword arguments to determine which
 		mode handlers should be included.
 		"""
-		actionFuncLists = {}
-		actionParameters = {}
-		for action in actionList:
-			parameters = action[1:]
-			actionParameters[action[0]] = parameters
-			actionFuncLists[action[0]] = self._getActionFunctionList(action[0], *parameters, **kw)
-		funcList = self._combineActionFunctionLists(actionFuncLists)
+		funcList, actionParameters = self._getComboActionFunctionList(actionList, (), **kw)
 		oneIsTrue = False
 		for actionName, actionFunc in funcList:
 			if actionFunc(*actionParameters[actionName]):
@@ -1064,13 +1181,7 @@ class IRCd(Service):
 		Accepts 'users' and 'channels' keyword arguments to determine which
 		mode handlers should be included.
 		"""
-		actionFuncLists = {}
-		actionParameters = {}
-		for action in actionList:
-			parameters = action[1:]
-			actionParameters[action[0]] = parameters
-			actionFuncLists[action[0]] = self._getActionFunctionList(action[0], *parameters, **kw)
-		funcList = self._combineActionFunctionLists(actionFuncLists)
+		funcList, actionParameters = self._getComboActionFunctionList(actionList, (), **kw)
 		oneIsFalse = False
 		for actionName, actionFunc in funcList:
 			if not actionFunc(*actionParameters[actionName]):
@@ -1086,13 +1197,7 @@ class IRCd(Service):
 		Accepts 'users' and 'channels' keyword arguments to determine which
 		mode handlers should be included.
 		"""
-		actionFuncLists = {}
-		actionParameters = {}
-		for action in actionList:
-			parameters = [data] + action[1:]
-			actionParameters[action[0]] = parameters
-			actionFuncLists[action[0]] = self._getActionFunctionList(action[0], *parameters, **kw)
-		funcList = self._combineActionFunctionLists(actionFuncLists)
+		funcList, actionParameters = self._getComboActionFunctionList(actionList, (data,), **kw)
 		for actionName, actionFunc in funcList:
 			actionFunc(*actionParameters[actionName])
 			if not data:
@@ -1108,13 +1213,7 @@ class IRCd(Service):
 		Accepts 'users' and 'channels' keyword arguments to determine which
 		mode handlers should be included.
 		"""
-		actionFuncLists = {}
-		actionParameters = {}
-		for action in actionList:
-			parameters = dataList + action[1:]
-			actionParameters[action[0]] = parameters
-			actionFuncLists[action[0]] = self._getActionFunctionList(action[0], *parameters, **kw)
-		funcList = self._combineActionFunctionLists(actionFuncLists)
+		funcList, actionParameters = self._getComboActionFunctionList(actionList, tuple(dataList), **kw)
 		for actionName, actionFunc in funcList:
 			actionFunc(*actionParameters[actionName])
 			for data in dataList:
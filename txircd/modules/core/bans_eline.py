@@ -2,9 +2,8 @@ from twisted.plugin import IPlugin
 from twisted.words.protocols import irc
 from txircd.module_interface import Command, ICommand, IModuleData, ModuleData
 from txircd.modules.xlinebase import XLineBase
-from txircd.utils import durationToSeconds, ircLower, now
+from txircd.utils import durationToSeconds, now
 from zope.interface import implements
-from fnmatch import fnmatchcase
 
 class ELine(ModuleData, XLineBase):
 	implements(IPlugin, IModuleData)
@@ -29,19 +28,6 @@ class ELine(ModuleData, XLineBase):
 	def load(self):
 		self.initializeLineStorage()
 	
-	def checkUserMatch(self, user, mask, data):
-		exceptMask = ircLower(mask)
-		userMask = ircLower("{}@{}".format(user.ident, user.host()))
-		if fnmatchcase(userMask, exceptMask):
-			return True
-		userMask = ircLower("{}@{}".format(user.ident, user.realHost))
-		if fnmatchcase(userMask, exceptMask):
-			return True
-		userMask = ircLower("{}@{}".format(user.ident, user.ip))
-		if fnmatchcase(userMask, exceptMask):
-			return True
-		return False
-	
 	def checkException(self, lineType, user, mask, data):
 		if lineType == "E":
 			return None
@@ -3,9 +3,8 @@ from twisted.words.protocols import irc
 from txircd.config import ConfigValidationError
 from txircd.module_interface import Command, ICommand, IModuleData, ModuleData
 from txircd.modules.xlinebase import XLineBase
-from txircd.utils import durationToSeconds, ircLower, now
+from txircd.utils import durationToSeconds, now
 from zope.interface import implements
-from fnmatch import fnmatchcase
 
 class GLine(ModuleData, XLineBase):
 	implements(IPlugin, IModuleData)
@@ -36,19 +35,6 @@ class GLine(ModuleData, XLineBase):
 		if "client_ban_msg" in config and not isinstance(config["client_ban_msg"], basestring):
 			raise ConfigValidationError("client_ban_msg", "value must be a string")
 	
-	def checkUserMatch(self, user, mask, data):
-		banMask = self.normalizeMask(mask)
-		userMask = ircLower("{}@{}".format(user.ident, user.host()))
-		if fnmatchcase(userMask, banMask):
-			return True
-		userMask = ircLower("{}@{}".format(user.ident, user.realHost))
-		if fnmatchcase(userMask, banMask):
-			return True
-		userMask = ircLower("{}@{}".format(user.ident, user.ip))
-		if fnmatchcase(userMask, banMask):
-			return True
-		return False
-	
 	def killUser(self, user, reason):
 		self.ircd.log.info("Matched user {user.uuid} ({user.ident}@{user.host()}) against a g:line: {reason}", user=user, reason=reason)
 		user.sendMessage(irc.ERR_YOUREBANNEDCREEP, self.ircd.config.get("client_ban_msg", "You're banned! Email abuse@example.com for assistance."))
@@ -108,13 +94,7 @@ class UserGLine(Command):
 			if not self.module.addLine(banmask, now(), data["duration"], user.hostmask(), data["reason"]):
 				user.sendMessage("NOTICE", "*** G:Line for {} is already set.".format(banmask))
 				return True
-			badUsers = []
-			for checkUser in self.module.ircd.users.itervalues():
-				reason = self.module.matchUser(checkUser)
-				if reason is not None:
-					badUsers.append((checkUser, reason))
-			for badUser in badUsers:
-				self.module.killUser(*badUser)
+			self.module.applyNewLine(banmask, self.module.killUser)
 			if data["duration"] > 0:
 				user.sendMessage("NOTICE", "*** Timed g:line for {} has been set, to expire in {} seconds.".format(banmask, data["duration"]))
 			else:
@@ -137,13 +117,7 @@ class ServerAddGLine(Command):
 	
 	def execute(self, server, data):
 		if self.module.executeServerAddCommand(server, data):
-			badUsers = []
-			for user in self.module.ircd.users.itervalues():
-				reason = self.module.matchUser(user)
-				if reason is not None:
-					badUsers.append((user, reason))
-			for user in badUsers:
-				self.module.killUser(*user)
+			self.module.applyNewLine(data["mask"], self.module.killUser)
 			return True
 		return None
 
@@ -3,9 +3,8 @@ from twisted.words.protocols import irc
 from txircd.config import ConfigValidationError
 from txircd.module_interface import Command, ICommand, IModuleData, ModuleData
 from txircd.modules.xlinebase import XLineBase
-from txircd.utils import durationToSeconds, ircLower, now
+from txircd.utils import durationToSeconds, now
 from zope.interface import implements
-from fnmatch import fnmatchcase
 
 class KLine(ModuleData, Command, XLineBase):
 	implements(IPlugin, IModuleData, ICommand)
@@ -33,19 +32,6 @@ class KLine(ModuleData, Command, XLineBase):
 		if "client_ban_msg" in config and not isinstance(config["client_ban_msg"], basestring):
 			raise ConfigValidationError("client_ban_msg", "value must be a string")
 	
-	def checkUserMatch(self, user, mask, data):
-		banMask = self.normalizeMask(mask)
-		userMask = ircLower("{}@{}".format(user.ident, user.host()))
-		if fnmatchcase(userMask, banMask):
-			return True
-		userMask = ircLower("{}@{}".format(user.ident, user.realHost))
-		if fnmatchcase(userMask, banMask):
-			return True
-		userMask = ircLower("{}@{}".format(user.ident, user.ip))
-		if fnmatchcase(userMask, banMask):
-			return True
-		return False
-	
 	def killUser(self, user, reason):
 		self.ircd.log.info("Matched user {user.uuid} ({user.ident}@{user.host()}) against a k:line: {reason}", user=user, reason=reason)
 		user.sendMessage(irc.ERR_YOUREBANNEDCREEP, self.ircd.config.get("client_ban_msg", "You're banned! Email abuse@example.com for assistance."))
@@ -99,13 +85,7 @@ class KLine(ModuleData, Command, XLineBase):
 			if not self.addLine(banmask, now(), data["duration"], user.hostmask(), data["reason"]):
 				user.sendMessage("NOTICE", "*** K:Line for {} is already set.".format(banmask))
 				return True
-			badUsers = []
-			for checkUser in self.ircd.users.itervalues():
-				reason = self.matchUser(checkUser)
-				if reason is not None:
-					badUsers.append((checkUser, reason))
-			for badUser in badUsers:
-				self.killUser(*badUser)
+			self.applyNewLine(banmask, self.killUser)
 			if data["duration"] > 0:
 				user.sendMessage("NOTICE", "*** Timed k:line for {} has been set, to expire in {} seconds.".format(banmask, data["duration"]))
 			else:
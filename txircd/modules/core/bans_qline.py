@@ -5,7 +5,6 @@ from txircd.module_interface import Command, ICommand, IModuleData, ModuleData
 from txircd.modules.xlinebase import XLineBase
 from txircd.utils import durationToSeconds, ircLower, now
 from zope.interface import implements
-from fnmatch import fnmatchcase
 
 class QLine(ModuleData, XLineBase):
 	implements(IPlugin, IModuleData)
@@ -36,10 +35,20 @@ class QLine(ModuleData, XLineBase):
 		if "client_ban_msg" in config and not isinstance(config["client_ban_msg"], basestring):
 			raise ConfigValidationError("client_ban_msg", "value must be a string")
 	
-	def checkUserMatch(self, user, mask, data):
+	def userMatchStrings(self, user, data):
 		if data and "newnick" in data:
-			return fnmatchcase(ircLower(data["newnick"]), ircLower(mask))
-		return fnmatchcase(ircLower(user.nick), ircLower(mask))
+			return [ircLower(data["newnick"])]
+		return [ircLower(user.nick)]
+	
+	def candidateUsers(self, normalMask):
+		if "*" in normalMask or "?" in normalMask or "[" in normalMask:
+			return [user for user in self.ircd.localUsers.itervalues() if user.nick is not None]
+		if normalMask not in self.ircd.userNicks:
+			return []
+		user = self.ircd.users[self.ircd.userNicks[normalMask]]
+		if user.uuid not in self.ircd.localUsers:
+			return []
+		return [user]
 	
 	def changeNick(self, user, reason, hasBeenConnected):
 		self.ircd.log.info("Matched user {user.uuid} ({user.nick}) against a q:line: {reason}", user=user, reason=reason)
@@ -49,6 +58,9 @@ class QLine(ModuleData, XLineBase):
 			user.sendMessage("NOTICE", "The nickname you chose was invalid. ({})".format(reason))
 		user.changeNick(user.uuid)
 	
+	def renameUser(self, user, reason):
+		self.changeNick(user, reason, True)
+	
 	def checkLines(self, user):
 		reason = self.matchUser(user)
 		if reason is not None:
@@ -101,10 +113,7 @@ class UserQLine(Command):
 			if not self.module.addLine(banmask, now(), data["duration"], user.hostmask(), data["reason"]):
 				user.sendMessage("NOTICE", "*** Q:Line for {} is already set.".format(banmask))
 				return True
-			for checkUser in self.module.ircd.users.itervalues():
-				reason = self.module.matchUser(checkUser)
-				if reason is not None:
-					self.module.changeNick(checkUser, reason, True)
+			self.module.applyNewLine(banmask, self.module.renameUser)
 			if data["duration"] > 0:
 				user.sendMessage("NOTICE", "*** Timed q:line for {} has been set, to expire in {} seconds.".format(banmask, data["duration"]))
 			else:
@@ -127,10 +136,7 @@ class ServerAddQLine(Command):
 	
 	def execute(self, server, data):
 		if self.module.executeServerAddCommand(server, data):
-			for user in self.module.ircd.users.itervalues():
-				reason = self.module.matchUser(user)
-				if reason is not None:
-					self.module.changeNick(user, reason, True)
+			self.module.applyNewLine(data["mask"], self.module.renameUser)
 			return True
 		return None
 
@@ -2,12 +2,90 @@ from twisted.plugin import IPlugin
 from twisted.words.protocols import irc
 from txircd.config import ConfigValidationError
 from txircd.module_interface import Command, ICommand, IModuleData, ModuleData
-from txircd.modules.xlinebase import XLineBase
+from txircd.modules.xlinebase import XLineBase, XLineIndex
 from txircd.utils import durationToSeconds, now
 from zope.interface import implements
-from fnmatch import fnmatchcase
+from binascii import hexlify, unhexlify
 import socket
 
+_addressBits = { socket.AF_INET: 32, socket.AF_INET6: 128 }
+
+def _parseAddress(address):
+	"""
+	Parses an IPv4 or IPv6 address. Returns a tuple of the address family and
+	the address as an integer, or None if it isn't a valid address.
+	"""
+	for family in (socket.AF_INET, socket.AF_INET6):
+		try:
+			return family, int(hexlify(socket.inet_pton(family, address)), 16)
+		except (socket.error, ValueError):
+			pass
+	return None
+
+def _parseCIDR(mask):
+	"""
+	Parses a CIDR mask (like 192.0.2.0/24). Returns a tuple of the address
+	family, the network address as an integer, and the prefix length, or None
+	if it isn't a valid CIDR mask.
+	"""
+	address, prefixLength = mask.split("/", 1)
+	parsedAddress = _parseAddress(address)
+	if parsedAddress is None or not prefixLength.isdigit():
+		return None
+	family, addressValue = parsedAddress
+	prefixLength = int(prefixLength)
+	if prefixLength > _addressBits[family]:
+		return None
+	hostBits = _addressBits[family] - prefixLength
+	return family, addressValue >> hostBits << hostBits, prefixLength
+
+def _formatAddress(family, addressValue):
+	return socket.inet_ntop(family, unhexlify("{:0{}x}".format(addressValue, _addressBits[family] / 4)))
+
+def _addressInCIDR(address, cidr):
+	"""
+	Checks whether a parsed address is in a parsed CIDR mask. IPv4-mapped IPv6
+	addresses are also checked against IPv4 masks.
+	"""
+	family, addressValue = address
+	cidrFamily, network, prefixLength = cidr
+	if family == socket.AF_INET6 and cidrFamily == socket.AF_INET and addressValue >> 32 == 0xffff:
+		family = socket.AF_INET
+		addressValue &= 0xffffffff
+	if family != cidrFamily:
+		return False
+	hostBits = _addressBits[family] - prefixLength
+	return addressValue >> hostBits == network >> hostBits
+
+def _cidrAddressPrefixes(cidr):
+	"""
+	Gets the text that the IP address of every user in a parsed CIDR mask
+	starts with. IPv4 addresses can also be IPv4-mapped IPv6 addresses, so a
+	list of prefixes is returned. The list is empty if the addresses don't
+	all start with the same text.
+	"""
+	family, network, prefixLength = cidr
+	if family == socket.AF_INET:
+		octets = [str((network >> shift) & 255) for shift in xrange(24, 24 - 8 * (prefixLength / 8), -8)]
+		if not octets:
+			return []
+		addressPrefix = ".".join(octets)
+		if len(octets) < 4:
+			addressPrefix = "{}.".format(addressPrefix)
+		return [addressPrefix, "0::ffff:{}".format(addressPrefix)] # IPv6 addresses of users are stored with a leading 0
+	groups = []
+	for shift in xrange(112, 112 - 16 * (prefixLength / 16), -16):
+		group = (network >> shift) & 0xffff
+		if not group: # Groups of zeroes may be shortened, so the text after this isn't fixed
+			break
+		groups.append("{:x}".format(group))
+	if not groups:
+		return []
+	addressPrefix = ":".join(groups)
+	if len(groups) < 8:
+		addressPrefix = "{}:".format(addressPrefix)
+	return [addressPrefix]
+
 class ZLine(ModuleData, XLineBase):
 	implements(IPlugin, IModuleData)
 	
@@ -35,10 +113,41 @@ class ZLine(ModuleData, XLineBase):
 		if "client_ban_msg" in config and not isinstance(config["client_ban_msg"], basestring):
 			raise ConfigValidationError("client_ban_msg", "value must be a string")
 	
+	def createLineIndex(self):
+		return CIDRLineIndex()
+	
+	def userMatchStrings(self, user, data):
+		return [self.normalizeMask(user.ip)]
+	
+	def candidateUsers(self, normalMask):
+		cidr = _parseCIDR(normalMask) if "/" in normalMask else None
+		if cidr is not None:
+			addressPrefixes = _cidrAddressPrefixes(cidr)
+			if not addressPrefixes:
+				return self.ircd.localUsers.values()
+			candidates = set()
+			for addressPrefix in addressPrefixes:
+				candidates.update(self.ircd.localUserIndex.candidateUsers(None, "{}*".format(addressPrefix)))
+			return candidates
+		candidates = self.ircd.localUserIndex.candidateUsers(None, normalMask)
+		if normalMask.startswith(":"): # IPv6 addresses of users are stored with a leading 0
+			candidates.update(self.ircd.localUserIndex.candidateUsers(None, "0{}".format(normalMask)))
+		return candidates
+	
 	def checkUserMatch(self, user, mask, data):
-		return fnmatchcase(user.ip, mask)
+		cidr = _parseCIDR(mask) if "/" in mask else None
+		if cidr is None:
+			return XLineBase.checkUserMatch(self, user, mask, data)
+		address = _parseAddress(user.ip)
+		return address is not None and _addressInCIDR(address, cidr)
 	
 	def normalizeMask(self, mask):
+		if "/" in mask: # Normalize CIDR masks to the network address
+			cidr = _parseCIDR(mask)
+			if cidr is None:
+				return mask.lower()
+			family, network, prefixLength = cidr
+			return "{}/{}".format(_formatAddress(family, network), prefixLength)
 		if ":" in mask and "*" not in mask and "?" not in mask: # Normalize non-wildcard IPv6 addresses
 			try:
 				return socket.inet_ntop(socket.AF_INET6, socket.inet_pton(socket.AF_INET6, mask)).lower()
@@ -81,6 +190,9 @@ class UserZLine(Command):
 			return {
 				"mask": banmask
 			}
+		if "/" in banmask and _parseCIDR(banmask) is None:
+			user.sendSingleError("ZLineMask", "NOTICE", "*** {} is not a valid CIDR mask.".format(banmask))
+			return None
 		return {
 			"mask": banmask,
 			"duration": durationToSeconds(params[1]),
@@ -93,13 +205,7 @@ class UserZLine(Command):
 			if not self.module.addLine(data["mask"], now(), data["duration"], user.hostmask(), data["reason"]):
 				user.sendMessage("NOTICE", "*** Z:Line for {} is already set.".format(banmask))
 				return True
-			badUsers = []
-			for checkUser in self.module.ircd.users.itervalues():
-				reason = self.module.matchUser(checkUser)
-				if reason is not None:
-					badUsers.append((checkUser, reason))
-			for badUser in badUsers:
-				self.module.killUser(*badUser)
+			self.module.applyNewLine(banmask, self.module.killUser)
 			if data["duration"] > 0:
 				user.sendMessage("NOTICE", "*** Timed z:line for {} has been set, to expire in {} seconds.".format(banmask, data["duration"]))
 			else:
@@ -122,13 +228,7 @@ class ServerAddZLine(Command):
 	
 	def execute(self, server, data):
 		if self.module.executeServerAddCommand(server, data):
-			badUsers = []
-			for user in self.module.ircd.users.itervalues():
-				reason = self.module.matchUser(user)
-				if reason is not None:
-					badUsers.append((user, reason))
-			for user in badUsers:
-				self.module.killUser(*user)
+			self.module.applyNewLine(data["mask"], self.module.killUser)
 			return True
 		return None
 
@@ -144,4 +244,97 @@ class ServerDelZLine(Command):
 	def execute(self, server, data):
 		return self.module.executeServerDelCommand(server, data)
 
+class CIDRLineIndex(XLineIndex):
+	"""
+	An X:line index that also matches CIDR masks, which are kept in a radix
+	tree for each address family. IPv4-mapped IPv6 addresses also match IPv4
+	masks.
+	"""
+	def __init__(self):
+		XLineIndex.__init__(self)
+		self._cidrTrees = { socket.AF_INET: CIDRTree(32), socket.AF_INET6: CIDRTree(128) }
+	
+	def add(self, normalMask, lineData):
+		cidr = _parseCIDR(normalMask) if "/" in normalMask else None
+		if cidr is None:
+			XLineIndex.add(self, normalMask, lineData)
+			return
+		self._lines[normalMask] = (self._nextOrder, lineData)
+		self._nextOrder += 1
+		family, network, prefixLength = cidr
+		self._cidrTrees[family].add(network, prefixLength, normalMask)
+	
+	def remove(self, normalMask):
+		cidr = _parseCIDR(normalMask) if "/" in normalMask else None
+		if cidr is None:
+			return XLineIndex.remove(self, normalMask)
+		family, network, prefixLength = cidr
+		self._cidrTrees[family].remove(network, prefixLength, normalMask)
+		return self._lines.pop(normalMask)[1]
+	
+	def _matchMasks(self, matchStrings):
+		matchedMasks = XLineIndex._matchMasks(self, matchStrings)
+		for matchString in matchStrings:
+			address = _parseAddress(matchString)
+			if address is None:
+				continue
+			family, addressValue = address
+			matchedMasks.update(self._cidrTrees[family].lookup(addressValue))
+			if family == socket.AF_INET6 and addressValue >> 32 == 0xffff:
+				matchedMasks.update(self._cidrTrees[socket.AF_INET].lookup(addressValue & 0xffffffff))
+		return matchedMasks
+
+class CIDRTree(object):
+	"""
+	A binary radix tree of network prefixes. Looking up an address finds the
+	values of all prefixes containing it in at most one step per bit of the
+	address, however many prefixes there are.
+	"""
+	def __init__(self, addressBits):
+		self.addressBits = addressBits
+		self._root = [None, None, None] # Each node is [zero child, one child, set of values for the prefix ending here]
+	
+	def add(self, network, prefixLength, value):
+		node = self._root
+		for bit in xrange(self.addressBits - 1, self.addressBits - 1 - prefixLength, -1):
+			branch = (network >> bit) & 1
+			if node[branch] is None:
+				node[branch] = [None, None, None]
+			node = node[branch]
+		if node[2] is None:
+			node[2] = set()
+		node[2].add(value)
+	
+	def remove(self, network, prefixLength, value):
+		path = []
+		node = self._root
+		for bit in xrange(self.addressBits - 1, self.addressBits - 1 - prefixLength, -1):
+			branch = (network >> bit) & 1
+			path.append((node, branch))
+			node = node[branch]
+			if node is None:
+				return
+		if node[2] is None:
+			return
+		node[2].discard(value)
+		if not node[2]:
+			node[2] = None
+		while path and node[0] is None and node[1] is None and node[2] is None: # Prune nodes that no longer lead to any prefixes
+			parent, branch = path.pop()
+			parent[branch] = None
+			node = parent
+	
+	def lookup(self, address):
+		values = []
+		node = self._root
+		bit = self.addressBits - 1
+		while node is not None:
+			if node[2] is not None:
+				values.extend(node[2])
+			if bit < 0:
+				break
+			node = node[(address >> bit) & 1]
+			bit -= 1
+		return values
+
 zlineModule = ZLine()
\ No newline at end of file
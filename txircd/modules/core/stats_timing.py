@@ -0,0 +1,26 @@
+from twisted.plugin import IPlugin
+from txircd.config import ConfigValidationError
+from txircd.module_interface import IModuleData, ModuleData
+from zope.interface import implements
+
+class TimingStatsReport(ModuleData):
+	implements(IPlugin, IModuleData)
+	
+	name = "TimingStatsReport"
+	core = True
+	
+	def actions(self):
+		return [ ("statsruntype-timing", 10, self.generateReport) ]
+	
+	def verifyConfig(self, config):
+		if "timing_stats_report_size" in config and (not isinstance(config["timing_stats_report_size"], int) or config["timing_stats_report_size"] < 1):
+			raise ConfigValidationError("timing_stats_report_size", "invalid number")
+	
+	def generateReport(self):
+		if self.ircd.timingStats is None:
+			return {
+				"disabled": "Timing stats are not enabled on this server"
+			}
+		return self.ircd.timingStats.report(self.ircd.config.get("timing_stats_report_size", 50))
+
+timingStatsReport = TimingStatsReport()
\ No newline at end of file
@@ -36,10 +36,7 @@ class GlobopsCommand(ModuleData):
 				sendToServers.add(self.ircd.servers[targetUser.uuid[:3]])
 		closestServers = set()
 		for server in sendToServers:
-			closestServer = server
-			while closestServer.nextClosest != self.ircd.serverID:
-				closestServer = self.ircd.servers[closestServer.nextClosest]
-			closestServers.add(closestServer)
+			closestServers.add(self.ircd.serverRoutes[server.serverID][0])
 		if fromServer:
 			closestServers.discard(fromServer)
 		for server in closestServers:
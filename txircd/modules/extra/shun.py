@@ -3,9 +3,8 @@ from twisted.words.protocols import irc
 from txircd.config import ConfigValidationError
 from txircd.module_interface import Command, ICommand, IModuleData, ModuleData
 from txircd.modules.xlinebase import XLineBase
-from txircd.utils import durationToSeconds, ircLower, now
+from txircd.utils import durationToSeconds, now
 from zope.interface import implements
-from fnmatch import fnmatchcase
 
 class Shun(ModuleData, XLineBase):
 	implements(IPlugin, IModuleData)
@@ -40,26 +39,17 @@ class Shun(ModuleData, XLineBase):
 				if not isinstance(command, basestring):
 					raise ConfigValidationError("shun_commands", "\"{}\" is not a valid command".format(command))
 	
-	def checkUserMatch(self, user, mask, data):
-		banMask = self.normalizeMask(mask)
-		userMask = ircLower("{}@{}".format(user.ident, user.host()))
-		if fnmatchcase(userMask, banMask):
-			return True
-		userMask = ircLower("{}@{}".format(user.ident, user.realHost))
-		if fnmatchcase(userMask, banMask):
-			return True
-		userMask = ircLower("{}@{}".format(user.ident, user.ip))
-		if fnmatchcase(userMask, banMask):
-			return True
-		return False
-	
 	def checkLines(self, user):
-		if self.matchUser(user) is not None:
-			user.cache["shunned"] = True
-			self.ircd.log.info("Matched user {user.uuid} ({user.ident}@{user.host()}) against a shun", user=user)
+		reason = self.matchUser(user)
+		if reason is not None:
+			self.shunUser(user, reason)
 		elif "shunned" in user.cache:
 			del user.cache["shunned"]
 	
+	def shunUser(self, user, reason):
+		user.cache["shunned"] = True
+		self.ircd.log.info("Matched user {user.uuid} ({user.ident}@{user.host()}) against a shun", user=user)
+	
 	def checkIdentChange(self, user, oldIdent, fromServer):
 		self.checkLines(user)
 	
@@ -80,9 +70,10 @@ class Shun(ModuleData, XLineBase):
 			return False
 		return None
 	
-	def onShunUpdate(self):
-		for user in self.ircd.users.itervalues():
-			self.checkLines(user)
+	def onShunRemoved(self):
+		for user in self.ircd.localUsers.itervalues():
+			if "shunned" in user.cache:
+				self.checkLines(user)
 
 class UserShun(Command):
 	implements(ICommand)
@@ -118,7 +109,7 @@ class UserShun(Command):
 			if not self.module.addLine(shunmask, now(), data["duration"], user.hostmask(), data["reason"]):
 				user.sendMessage("NOTICE", "*** Shun for {} is already set.".format(shunmask))
 				return True
-			self.module.onShunUpdate()
+			self.module.applyNewLine(shunmask, self.module.shunUser)
 			if data["duration"] > 0:
 				user.sendMessage("NOTICE", "*** Timed shun for {} has been set, to expire in {} seconds.".format(shunmask, data["duration"]))
 			else:
@@ -128,7 +119,7 @@ class UserShun(Command):
 			user.sendMessage("NOTICE", "*** Shun for {} doesn't exist.".format(shunmask))
 			return True
 		user.sendMessage("NOTICE", "*** Shun for {} has been removed.".format(shunmask))
-		self.module.onShunUpdate()
+		self.module.onShunRemoved()
 		return True
 
 class ServerAddShun(Command):
@@ -142,7 +133,8 @@ class ServerAddShun(Command):
 	
 	def execute(self, server, data):
 		commandSuccess = self.module.executeServerAddCommand(server, data)
-		self.module.onShunUpdate()
+		if commandSuccess:
+			self.module.applyNewLine(data["mask"], self.module.shunUser)
 		return commandSuccess
 
 class ServerDelShun(Command):
@@ -156,7 +148,8 @@ class ServerDelShun(Command):
 	
 	def execute(self, server, data):
 		commandSuccess = self.module.executeServerDelCommand(server, data)
-		self.module.onShunUpdate()
+		if commandSuccess:
+			self.module.onShunRemoved()
 		return commandSuccess
 
 shunModule = Shun()
\ No newline at end of file
@@ -37,8 +37,8 @@ class AccountNotify(ModuleData):
 		conditionalTags = {}
 		self.ircd.runActionStandard("sendingusertags", user, conditionalTags)
 		for channel in user.channels:
-			for noticeUser in channel.users.iterkeys():
-				if noticeUser.uuid[:3] == self.ircd.serverID and noticeUser != user and "capabilities" in noticeUser.cache and "account-notify" in noticeUser.cache["capabilities"]:
+			for noticeUser in channel.localUsers:
+				if noticeUser != user and "capabilities" in noticeUser.cache and "account-notify" in noticeUser.cache["capabilities"]:
 					noticeUsers.add(noticeUser)
 		if value:
 			for noticeUser in noticeUsers:
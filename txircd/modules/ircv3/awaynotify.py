@@ -38,8 +38,8 @@ class AwayNotify(ModuleData):
 		conditionalTags = {}
 		self.ircd.runActionStandard("sendingusertags", user, conditionalTags)
 		for channel in user.channels:
-			for noticeUser in channel.users.iterkeys():
-				if noticeUser.uuid[:3] == self.ircd.serverID and noticeUser != user and "capabilities" in noticeUser.cache and "away-notify" in noticeUser.cache["capabilities"]:
+			for noticeUser in channel.localUsers:
+				if noticeUser != user and "capabilities" in noticeUser.cache and "away-notify" in noticeUser.cache["capabilities"]:
 					noticeUsers.add(noticeUser)
 		if value:
 			for noticeUser in noticeUsers:
@@ -57,8 +57,8 @@ class AwayNotify(ModuleData):
 		noticePrefix=user.hostmask()
 		conditionalTags = {}
 		self.ircd.runActionStandard("sendingusertags", user, conditionalTags)
-		for noticeUser in channel.users.iterkeys():
-			if noticeUser.uuid[:3] == self.ircd.serverID and "capabilities" in noticeUser.cache and "away-notify" in noticeUser.cache["capabilities"]:
+		for noticeUser in channel.localUsers:
+			if "capabilities" in noticeUser.cache and "away-notify" in noticeUser.cache["capabilities"]:
 				tags = noticeUser.filterConditionalTags(conditionalTags)
 				noticeUser.sendMessage("AWAY", awayReason, to=None, prefix=noticePrefix, tags=tags)
 
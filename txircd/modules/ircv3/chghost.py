@@ -48,8 +48,7 @@ class ChangeHost(ModuleData):
 		self.ircd.runActionStandard("sendingusertags", user, conditionalTags)
 		channelUsers = set()
 		for channel in user.channels:
-			for chanUser in channel.users.iterkeys():
-				channelUsers.add(chanUser)
+			channelUsers.update(channel.localUsers)
 		for chanUser in channelUsers:
 			if "capabilities" not in chanUser.cache or "chghost" not in chanUser.cache["capabilities"]:
 				continue
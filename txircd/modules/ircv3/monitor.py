@@ -118,7 +118,7 @@ class Monitor(ModuleData, Command):
 						monitoringUser.sendMessage("METADATA", key, visibility, value, to=user.nick)
 					sentToUsers.add(monitoringUser)
 		for channel in user.channels:
-			for inChannelUser in channel.users.iterkeys():
+			for inChannelUser in channel.localUsers:
 				if inChannelUser in sentToUsers:
 					continue
 				if "capabilities" in inChannelUser.cache and "metadata-notify" in inChannelUser.cache["capabilities"] and inChannelUser.canSeeMetadataVisibility(visibility):
@@ -129,7 +129,7 @@ class Monitor(ModuleData, Command):
 					sentToUsers.add(inChannelUser)
 	
 	def notifyChannelMetadataChange(self, channel, key, oldValue, value, visibility, setByUser, fromServer):
-		for user in channel.users.iterkeys():
+		for user in channel.localUsers:
 			if "capabilities" in user.cache and "metadata-notify" in user.cache["capabilities"] and user.canSeeMetadataVisibility(visibility):
 				if value is None:
 					user.sendMessage("METADATA", key, visibility, to=channel.name)
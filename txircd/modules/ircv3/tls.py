@@ -85,6 +85,7 @@ class StartTLS(ModuleData, Command):
 			return True
 		user.transport = secureTransport
 		user.sendMessage(irc.RPL_STARTTLS, "STARTTLS successful; proceed with TLS handshake")
+		user.flushOutput() # The reply and anything queued before it have to be sent in plain text before TLS starts
 		secureTransport.startTLS(self.certContext)
 		user.secureConnection = ISSLTransport(secureTransport, None) is not None
 		return True
@@ -1,49 +1,141 @@
+from twisted.internet.task import cooperate
 from txircd.utils import ircLower, now, timestamp
 from datetime import datetime, timedelta
+from fnmatch import fnmatchcase, translate
+from heapq import heappop, heappush
+import re
 
 class XLineBase(object):
 	lineType = None
 	propagateToServers = True
+	newLineCheckBatchSize = 1000
 	
 	def initializeLineStorage(self):
 		if "xlines" not in self.ircd.storage:
 			self.ircd.storage["xlines"] = {}
 		if self.lineType not in self.ircd.storage["xlines"]:
 			self.ircd.storage["xlines"][self.lineType] = []
+		self._lineIndex = self.createLineIndex()
+		self._expiryHeap = []
+		lines = self.ircd.storage["xlines"][self.lineType]
+		for lineData in lines[:]:
+			normalMask = self.normalizeMask(lineData["mask"])
+			if normalMask in self._lineIndex:
+				lines.remove(lineData) # Duplicates can't be matched or removed separately, so drop them
+				continue
+			self._indexLine(normalMask, lineData)
 		self.expireLines()
 	
+	def createLineIndex(self):
+		"""
+		Creates the index used to match lines of this type.
+		"""
+		return XLineIndex()
+	
+	def _indexLine(self, normalMask, lineData):
+		self._lineIndex.add(normalMask, lineData)
+		if lineData["duration"]:
+			expireTime = lineData["created"] + timedelta(seconds=lineData["duration"])
+			heappush(self._expiryHeap, (expireTime, normalMask, lineData))
+	
+	def _removeLine(self, normalMask):
+		lineData = self._lineIndex.remove(normalMask)
+		lines = self.ircd.storage["xlines"][self.lineType]
+		for index, storedLineData in enumerate(lines):
+			if storedLineData is lineData:
+				del lines[index]
+				break
+	
 	def matchUser(self, user, data = None):
 		if not self.lineType:
 			return None
 		if user.uuid[:3] != self.ircd.serverID:
 			return None # The remote server should handle the users on that server
 		self.expireLines()
-		for lineData in self.ircd.storage["xlines"][self.lineType]:
-			mask = lineData["mask"]
-			if self.checkUserMatch(user, mask, data) and self.ircd.runComboActionUntilValue((("verifyxlinematch-{}".format(self.lineType), user, mask, data), ("verifyxlinematch", self.lineType, user, mask, data)), users=[user]) is not False:
+		for lineData in self._lineIndex.match(self.userMatchStrings(user, data)):
+			if self._verifyMatch(user, lineData["mask"], data):
 				return lineData["reason"]
 		return None
 	
+	def _verifyMatch(self, user, mask, data):
+		return self.ircd.runComboActionUntilValue((("verifyxlinematch-{}".format(self.lineType), user, mask, data), ("verifyxlinematch", self.lineType, user, mask, data)), users=[user]) is not False
+	
+	def applyNewLine(self, mask, applyFunction):
+		"""
+		Checks the local users against a line that was just added, without
+		checking any other lines, and calls applyFunction with each matching
+		user and the line's reason.
+		Only the users returned by candidateUsers are checked. If there are more
+		of them than newLineCheckBatchSize, they're checked over several reactor
+		iterations so that the server keeps responding.
+		"""
+		if not self.lineType:
+			return
+		normalMask = self.normalizeMask(mask)
+		lineData = self._lineIndex.get(normalMask)
+		if lineData is None:
+			return
+		users = list(self.candidateUsers(normalMask))
+		checkIterator = self._checkNewLine(normalMask, lineData, users, applyFunction)
+		if len(users) <= self.newLineCheckBatchSize:
+			for _ in checkIterator:
+				pass
+			return
+		cooperate(checkIterator).whenDone().addErrback(lambda failure: self.ircd.log.failure("An error occurred while checking users against a new {lineType}:line", failure, lineType=self.lineType))
+	
+	def _checkNewLine(self, normalMask, lineData, users, applyFunction):
+		for user in users:
+			if self._lineIndex.get(normalMask) is not lineData:
+				return # The line was removed while we were still checking users
+			if user.uuid in self.ircd.localUsers and self.checkUserMatch(user, lineData["mask"], None) and self._verifyMatch(user, lineData["mask"], None):
+				applyFunction(user, lineData["reason"])
+			yield None
+	
+	def candidateUsers(self, normalMask):
+		"""
+		Returns the local users who could match the given normalized mask. Every
+		user matching the mask must be included, but not every user included
+		needs to match.
+		By default, masks are matched as ident@host masks using the local user
+		index.
+		"""
+		if "@" not in normalMask:
+			return self.ircd.localUsers.values()
+		identMask, hostMask = normalMask.split("@", 1)
+		return self.ircd.localUserIndex.candidateUsers(identMask, hostMask)
+	
+	def userMatchStrings(self, user, data):
+		"""
+		Returns the list of strings against which masks for this line type are
+		matched for the given user, normalized the same way as the masks are.
+		By default, these are the user's ident@host with the displayed host,
+		the real host, and the IP address.
+		"""
+		return [user.lowerHostmask().split("!", 1)[1], user.lowerHostmaskWithRealHost().split("!", 1)[1], user.lowerHostmaskWithIP().split("!", 1)[1]]
+	
 	def checkUserMatch(self, user, mask, data):
-		pass
+		normalMask = self.normalizeMask(mask)
+		for matchString in self.userMatchStrings(user, data):
+			if fnmatchcase(matchString, normalMask):
+				return True
+		return False
 	
 	def addLine(self, mask, createdTime, durationSeconds, setter, reason, fromServer = None):
 		if not self.lineType:
 			return False
 		self.expireLines()
 		normalMask = self.normalizeMask(mask)
-		lines = self.ircd.storage["xlines"][self.lineType]
-		for lineData in lines:
-			lineMask = self.normalizeMask(lineData["mask"])
-			if normalMask == lineMask:
-				return False
-		lines.append({
+		if normalMask in self._lineIndex:
+			return False
+		lineData = {
 			"mask": mask,
 			"created": createdTime,
 			"duration": durationSeconds,
 			"setter": setter,
 			"reason": reason
-		})
+		}
+		self.ircd.storage["xlines"][self.lineType].append(lineData)
+		self._indexLine(normalMask, lineData)
 		if self.propagateToServers:
 			self.ircd.broadcastToServers(fromServer, "ADDLINE", self.lineType, mask, setter, str(timestamp(createdTime)), str(durationSeconds), reason, prefix=self.ircd.serverID)
 		return True
@@ -52,14 +144,12 @@ class XLineBase(object):
 		if not self.lineType:
 			return False
 		normalMask = self.normalizeMask(mask)
-		for index, lineData in enumerate(self.ircd.storage["xlines"][self.lineType]):
-			lineMask = self.normalizeMask(lineData["mask"])
-			if normalMask == lineMask:
-				del self.ircd.storage["xlines"][self.lineType][index]
-				if self.propagateToServers:
-					self.ircd.broadcastToServers(fromServer, "DELLINE", self.lineType, mask)
-				return True
-		return False
+		if normalMask not in self._lineIndex:
+			return False
+		self._removeLine(normalMask)
+		if self.propagateToServers:
+			self.ircd.broadcastToServers(fromServer, "DELLINE", self.lineType, mask)
+		return True
 	
 	def normalizeMask(self, mask):
 		return ircLower(mask)
@@ -68,18 +158,10 @@ class XLineBase(object):
 		if not self.lineType:
 			return
 		currentTime = now()
-		expiredLines = []
-		lines = self.ircd.storage["xlines"][self.lineType]
-		for lineData in lines:
-			durationSeconds = lineData["duration"]
-			if not durationSeconds:
-				continue
-			duration = timedelta(seconds=lineData["duration"])
-			expireTime = lineData["created"] + duration
-			if expireTime < currentTime:
-				expiredLines.append(lineData)
-		for lineData in expiredLines:
-			lines.remove(lineData)
+		while self._expiryHeap and self._expiryHeap[0][0] < currentTime:
+			expireTime, normalMask, lineData = heappop(self._expiryHeap)
+			if self._lineIndex.get(normalMask) is lineData: # Skip lines that were already removed
+				self._removeLine(normalMask)
 	
 	def generateInfo(self):
 		if not self.lineType:
@@ -131,4 +213,101 @@ class XLineBase(object):
 		self.expireLines()
 		if self.propagateToServers:
 			for lineData in self.ircd.storage["xlines"][self.lineType]:
-				server.sendMessage("ADDLINE", self.lineType, lineData["mask"], lineData["setter"], str(timestamp(lineData["created"])), str(lineData["duration"]), lineData["reason"], prefix=self.ircd.serverID)
\ No newline at end of file
+				server.sendMessage("ADDLINE", self.lineType, lineData["mask"], lineData["setter"], str(timestamp(lineData["created"])), str(lineData["duration"]), lineData["reason"], prefix=self.ircd.serverID)
+
+def _maskPattern(mask):
+	pattern = translate(mask)
+	if pattern.endswith("\\Z(?ms)"): # Leave the end and flags for the combined expression
+		pattern = pattern[:-7]
+	return pattern
+
+class XLineIndex(object):
+	"""
+	Indexes the lines of one X:line type by normalized mask for matching.
+	Masks without wildcards are looked up directly. Masks with wildcards are
+	compiled into combined regular expressions in groups of groupSize, so
+	adding or removing a line only recompiles the group that line is in, and
+	only the masks in groups that match are checked individually.
+	"""
+	groupSize = 100
+	
+	def __init__(self):
+		self._lines = {}
+		self._exactMasks = set()
+		self._wildcardGroups = []
+		self._maskGroups = {}
+		self._nextOrder = 0
+	
+	def __contains__(self, normalMask):
+		return normalMask in self._lines
+	
+	def __len__(self):
+		return len(self._lines)
+	
+	def get(self, normalMask):
+		"""
+		Returns the line data for the given normalized mask, or None if there's
+		no line with that mask.
+		"""
+		if normalMask not in self._lines:
+			return None
+		return self._lines[normalMask][1]
+	
+	def add(self, normalMask, lineData):
+		"""
+		Adds a line to the index.
+		"""
+		self._lines[normalMask] = (self._nextOrder, lineData)
+		self._nextOrder += 1
+		if "*" not in normalMask and "?" not in normalMask and "[" not in normalMask:
+			self._exactMasks.add(normalMask)
+			return
+		if not self._wildcardGroups or len(self._wildcardGroups[-1][0]) >= self.groupSize:
+			self._wildcardGroups.append([set(), None])
+		group = self._wildcardGroups[-1]
+		group[0].add(normalMask)
+		group[1] = None
+		self._maskGroups[normalMask] = group
+	
+	def remove(self, normalMask):
+		"""
+		Removes a line from the index. Returns the line data of the removed
+		line.
+		"""
+		lineData = self._lines.pop(normalMask)[1]
+		if normalMask in self._exactMasks:
+			self._exactMasks.remove(normalMask)
+			return lineData
+		group = self._maskGroups.pop(normalMask)
+		group[0].remove(normalMask)
+		group[1] = None
+		if not group[0]:
+			self._wildcardGroups.remove(group)
+		return lineData
+	
+	def match(self, matchStrings):
+		"""
+		Returns the line data of all lines matching any of the given strings,
+		in the order the lines were added.
+		"""
+		matchedMasks = self._matchMasks(matchStrings)
+		return [self._lines[mask][1] for mask in sorted(matchedMasks, key=lambda mask: self._lines[mask][0])]
+	
+	def _matchMasks(self, matchStrings):
+		matchedMasks = set()
+		for matchString in matchStrings:
+			if matchString in self._exactMasks:
+				matchedMasks.add(matchString)
+		for group in self._wildcardGroups:
+			if group[1] is None:
+				group[1] = re.compile("(?:{})\\Z".format("|".join(_maskPattern(mask) for mask in group[0])), re.DOTALL | re.MULTILINE).match
+			groupMatcher = group[1]
+			for matchString in matchStrings:
+				if groupMatcher(matchString):
+					for mask in group[0]:
+						for groupMatchString in matchStrings:
+							if fnmatchcase(groupMatchString, mask):
+								matchedMasks.add(mask)
+								break
+					break
+		return matchedMasks
\ No newline at end of file
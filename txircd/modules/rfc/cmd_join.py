@@ -39,15 +39,11 @@ class JoinCommand(ModuleData):
 	def broadcastJoin(self, messageUsers, channel, user):
 		userClosest = None
 		if user.uuid[:3] != self.ircd.serverID:
-			userClosest = self.ircd.servers[user.uuid[:3]]
-			while userClosest.nextClosest != self.ircd.serverID:
-				userClosest = self.ircd.servers[userClosest.nextClosest]
+			userClosest = self.ircd.serverRoutes[user.uuid[:3]][0]
 		self.ircd.broadcastToServers(userClosest, "JOIN", channel.name, prefix=user.uuid)
 	
 	def propagateJoin(self, channel, user):
-		fromServer = self.ircd.servers[user.uuid[:3]]
-		while fromServer.nextClosest != self.ircd.serverID:
-			fromServer = self.ircd.servers[fromServer.nextClosest]
+		fromServer = self.ircd.serverRoutes[user.uuid[:3]][0]
 		self.ircd.broadcastToServers(fromServer, "JOIN", channel.name, prefix=user.uuid)
 
 class JoinChannel(Command):
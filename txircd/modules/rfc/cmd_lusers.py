@@ -2,7 +2,6 @@ from twisted.plugin import IPlugin
 from twisted.words.protocols import irc
 from txircd.module_interface import Command, ICommand, IModuleData, ModuleData
 from zope.interface import implements
-from collections import defaultdict
 
 irc.RPL_LOCALUSERS = "265"
 irc.RPL_GLOBALUSERS = "266"
@@ -14,41 +13,69 @@ class LUsersCommand(ModuleData, Command):
 	core = True
 	
 	def actions(self):
-		return [ ("welcome", 6, lambda user: self.execute(user, {})) ]
+		return [ ("welcome", 6, lambda user: self.execute(user, {})),
+		         ("modechange-user-i", 1, self.updateInvisible),
+		         ("modechange-user-o", 1, self.updateOper),
+		         ("quit", 1, self.removeUser),
+		         ("remotequit", 1, self.removeUser),
+		         ("localquit", 1, self.removeUser) ]
 	
 	def userCommands(self):
 		return [ ("LUSERS", 1, self) ]
-
-	def getStorage(self):
-		if "user_count_max" not in self.ircd.storage:
-			self.ircd.storage["user_count_max"] = {}
-		return self.ircd.storage["user_count_max"]
+	
+	def load(self):
+		# Keep the sets of invisible users and opers up to date as modes change so that we don't have to
+		# go through every user every time someone connects
+		self.invisibleUsers = set()
+		self.operUsers = set()
+		for user in self.ircd.users.itervalues():
+			if "i" in user.modes:
+				self.invisibleUsers.add(user)
+			if "o" in user.modes:
+				self.operUsers.add(user)
+		if "user_count_max" in self.ircd.storage:
+			self.maxCounts = self.ircd.storage["user_count_max"]
+		else:
+			self.maxCounts = {}
+	
+	def updateInvisible(self, user, *params):
+		if "i" in user.modes:
+			self.invisibleUsers.add(user)
+		else:
+			self.invisibleUsers.discard(user)
+	
+	def updateOper(self, user, *params):
+		if "o" in user.modes:
+			self.operUsers.add(user)
+		else:
+			self.operUsers.discard(user)
+	
+	def removeUser(self, user, *params):
+		self.invisibleUsers.discard(user)
+		self.operUsers.discard(user)
 	
 	def updateMaxCounts(self, counts):
-		maxes = self.getStorage()
+		changed = False
 		for key in ("users", "local"):
-			if counts[key] > maxes.get(key, 0):
-				maxes[key] = counts[key]
-		return maxes
+			if counts[key] > self.maxCounts.get(key, 0):
+				self.maxCounts[key] = counts[key]
+				changed = True
+		if changed: # Only write to storage when there's a new max
+			self.ircd.storage["user_count_max"] = self.maxCounts
+		return self.maxCounts
 	
 	def countStats(self):
-		counts = defaultdict(lambda: 0)
+		counts = {}
 		counts["users"] = len(self.ircd.users)
 		counts["servers"] = len(self.ircd.servers) + 1
 		counts["channels"] = len(self.ircd.channels)
-
-		for user in self.ircd.users.itervalues():
-			if "i" in user.modes:
-				counts["invisible"] += 1
-			if "o" in user.modes:
-				counts["opers"] += 1
-			if user.uuid[:3] == self.ircd.serverID:
-				counts["local"] += 1
-
+		counts["invisible"] = len(self.invisibleUsers)
+		counts["opers"] = len(self.operUsers)
+		counts["local"] = len(self.ircd.localUsers)
+		counts["localservers"] = 0
 		for server in self.ircd.servers.itervalues():
 			if server.nextClosest == self.ircd.serverID:
 				counts["localservers"] += 1
-
 		counts["visible"] = counts["users"] - counts["invisible"]
 		maxes = self.updateMaxCounts(counts)
 		return counts, maxes
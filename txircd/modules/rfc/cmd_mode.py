@@ -82,9 +82,7 @@ class ModeCommand(ModuleData):
 		if source[:3] == self.ircd.serverID:
 			fromServer = None
 		else:
-			fromServer = self.ircd.servers[source[:3]]
-			while fromServer.nextClosest != self.ircd.serverID:
-				fromServer = self.ircd.servers[fromServer.nextClosest]
+			fromServer = self.ircd.serverRoutes[source[:3]][0]
 		for modeOut in modeOuts:
 			modeStr = modeOut[0]
 			params = modeOut[1:]
@@ -114,9 +112,7 @@ class ModeCommand(ModuleData):
 		if source[:3] == self.ircd.serverID:
 			fromServer = None
 		else:
-			fromServer = self.ircd.servers[source[:3]]
-			while fromServer.nextClosest != self.ircd.serverID:
-				fromServer = self.ircd.servers[fromServer.nextClosest]
+			fromServer = self.ircd.serverRoutes[source[:3]][0]
 		for modeOut in modeOuts:
 			modeStr = modeOut[0]
 			params = modeOut[1:]
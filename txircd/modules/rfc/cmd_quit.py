@@ -48,9 +48,7 @@ class QuitCommand(ModuleData, Command):
 			self.ircd.broadcastToServers(None, "QUIT", reason, prefix=user.uuid)
 	
 	def propagateQuit(self, user, reason):
-		fromServer = self.ircd.servers[user.uuid[:3]]
-		while fromServer.nextClosest != self.ircd.serverID:
-			fromServer = self.ircd.servers[fromServer.nextClosest]
+		fromServer = self.ircd.serverRoutes[user.uuid[:3]][0]
 		self.ircd.broadcastToServers(fromServer, "QUIT", reason, prefix=user.uuid)
 
 class UserQuit(Command):
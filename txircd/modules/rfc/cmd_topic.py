@@ -39,21 +39,18 @@ class TopicCommand(ModuleData):
 			sourceUser = self.ircd.users[setter]
 			conditionalTags = {}
 			self.ircd.runActionStandard("sendingusertags", sourceUser, conditionalTags)
-		for user in channel.users.iterkeys():
-			if user.uuid[:3] == self.ircd.serverID:
-				tags = {}
-				if userSource:
-					tags = user.filterConditionalTags(conditionalTags)
-				user.sendMessage("TOPIC", channel.topic, to=channel.name, prefix=channel.topicSetter, tags=tags)
+		for user in channel.localUsers:
+			tags = {}
+			if userSource:
+				tags = user.filterConditionalTags(conditionalTags)
+			user.sendMessage("TOPIC", channel.topic, to=channel.name, prefix=channel.topicSetter, tags=tags)
 		sourceServer = None
 		if userSource and setter[:3] == self.ircd.serverID:
 			if sourceUser not in channel.users:
 				tags = sourceUser.filterConditionalTags(conditionalTags)
 				sourceUser.sendMessage("TOPIC", channel.topic, to=channel.name, prefix=channel.topicSetter, tags=tags)
 		elif setter != self.ircd.serverID:
-			sourceServer = self.ircd.servers[setter[:3]]
-			while sourceServer.nextClosest != self.ircd.serverID:
-				sourceServer = self.ircd.servers[sourceServer.nextClosest]
+			sourceServer = self.ircd.serverRoutes[setter[:3]][0]
 		self.ircd.broadcastToServers(sourceServer, "TOPIC", channel.name, str(timestamp(channel.existedSince)), str(timestamp(channel.topicTime)), channel.topic, prefix=setter)
 	
 	def sendChannelTopic(self, channel, user):
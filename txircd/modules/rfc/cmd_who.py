@@ -36,7 +36,7 @@ class WhoCommand(ModuleData, Command):
 			for targetUser in self.ircd.users.itervalues():
 				if not targetUser.isRegistered():
 					continue
-				if not set(user.channels).intersection(targetUser.channels) and self.ircd.runActionUntilValue("showuser", user, targetUser, users=[user, targetUser]) is not False:
+				if user.channels.isdisjoint(targetUser.channels) and self.ircd.runActionUntilValue("showuser", user, targetUser, users=[user, targetUser]) is not False:
 					matchingUsers.append(targetUser)
 		elif mask in self.ircd.channels:
 			channel = self.ircd.channels[data["mask"]]
@@ -67,11 +67,7 @@ class WhoCommand(ModuleData, Command):
 			status = self.ircd.runActionUntilValue("channelstatuses", channel, targetUser, user, users=[targetUser, user], channels=[channel]) if channel else ""
 			hopcount = 0
 			if user.uuid[:3] != self.ircd.serverID:
-				countingServer = server
-				hopcount = 1
-				while countingServer.nextClosest != self.ircd.serverID:
-					countingServer = self.ircd.servers[countingServer.nextClosest]
-					hopcount += 1
+				hopcount = self.ircd.serverRoutes[server.serverID][1]
 			user.sendMessage(irc.RPL_WHOREPLY, mask, targetUser.ident, targetUser.host(), serverName, targetUser.nick, "{}{}{}".format("G" if isAway else "H", "*" if isOper else "", status), "{} {}".format(hopcount, targetUser.gecos))
 		user.sendMessage(irc.RPL_ENDOFWHO, mask, "End of /WHO list")
 		return True
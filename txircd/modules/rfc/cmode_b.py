@@ -3,7 +3,8 @@ from twisted.words.protocols import irc
 from txircd.module_interface import IMode, IModuleData, Mode, ModuleData
 from txircd.utils import ircLower, ModeType, timestamp
 from zope.interface import implements
-from fnmatch import fnmatchcase
+from fnmatch import fnmatchcase, translate
+import re
 
 class BanMode(ModuleData, Mode):
 	implements(IPlugin, IModuleData, IMode)
@@ -22,126 +23,96 @@ class BanMode(ModuleData, Mode):
 		         ("userbancheck", 1, self.matchBans),
 		         ("join", 10, self.populateBanCache),
 		         ("join", 9, self.autoStatus),
-		         ("updateuserbancache", 1, self.updateUserCaches)
+		         ("updateuserbancache", 1, self.updateUserCaches),
+		         ("changenick", 1, self.clearUserBanCache),
+		         ("remotechangenick", 1, self.clearUserBanCache),
+		         ("changeident", 1, self.clearUserBanCache),
+		         ("remotechangeident", 1, self.clearUserBanCache),
+		         ("changehost", 1, self.clearUserBanCache),
+		         ("moduleload", 1, self.clearBanCaches),
+		         ("moduleunload", 1, self.clearBanCaches)
 		]
 	
 	def banMatchesUser(self, user, banmask):
-		matchingExtban = ""
-		matchNegated = False
-		if ":" in banmask and ("@" not in banmask or banmask.find(":") < banmask.find("@")):
-			matchingExtban, banmask = banmask.split(":", 1)
-			if matchingExtban and matchingExtban[0] == "~":
-				matchNegated = True
-				matchingExtban = matchingExtban[1:]
+		matchingExtban, matchNegated, banmask = _parseBanmask(banmask)
 		if matchingExtban:
-			return self.ircd.runActionUntilTrue("usermatchban-{}".format(matchingExtban), user, matchNegated, banmask)
+			matchFunction, banmask = self.extbanMatcher(matchingExtban, banmask)
+			return matchFunction(user, matchNegated, banmask)
 		return self.matchHostmask(user, banmask)
 	
+	def extbanMatcher(self, matchingExtban, banmask):
+		"""
+		Looks up how to match a matching extban. Returns a tuple of the function
+		to call with the user, whether the match is negated, and the banmask,
+		and the banmask to pass to it.
+		Modules provide a matching extban by putting the function in the
+		function cache as "extbanmatch-<extban>". They can also provide a
+		function as "extbancompile-<extban>" that takes the banmask and returns
+		what to pass to the matching function in its place, which is done once
+		each time the ban list is compiled. Extbans without a matching function
+		are matched with the usermatchban-<extban> action.
+		"""
+		matchKey = "extbanmatch-{}".format(matchingExtban)
+		if matchKey not in self.ircd.functionCache:
+			actionName = "usermatchban-{}".format(matchingExtban)
+			return (lambda user, matchNegated, banmask: self.ircd.runActionUntilTrue(actionName, user, matchNegated, banmask)), banmask
+		compileKey = "extbancompile-{}".format(matchingExtban)
+		if compileKey in self.ircd.functionCache:
+			banmask = self.ircd.functionCache[compileKey](banmask)
+		return self.ircd.functionCache[matchKey], banmask
+	
 	def matchHostmask(self, user, banmask):
 		banmask = ircLower(banmask)
-		userMask = ircLower(user.hostmask())
-		if fnmatchcase(userMask, banmask):
+		if fnmatchcase(user.lowerHostmask(), banmask):
 			return True
-		userMask = ircLower(user.hostmaskWithRealHost())
-		if fnmatchcase(userMask, banmask):
+		if fnmatchcase(user.lowerHostmaskWithRealHost(), banmask):
 			return True
-		userMask = ircLower(user.hostmaskWithIP())
-		return fnmatchcase(userMask, banmask)
+		return fnmatchcase(user.lowerHostmaskWithIP(), banmask)
 	
 	def checkAction(self, actionName, mode, channel, user, *params, **kw):
 		if "b" not in channel.modes:
 			return None
 		if mode == "b":
-			if "b" in channel.modes:
-				return "" # We'll handle the iteration
-			return None
-		if user in channel.users and "bans" in channel.users[user]:
-			if mode in channel.users[user]["bans"]:
-				return channel.users[user]["bans"][mode]
-			return None
-		for paramData in channel.modes["b"]:
-			param = paramData[0]
-			actionExtban = ""
-			actionParam = ""
-			if ";" in param:
-				actionExtban, param = param.split(";", 1)
-				if ":" in actionExtban:
-					actionExtban, actionParam = actionExtban.split(":", 1)
-			if actionExtban != mode:
-				continue
-			match = self.banMatchesUser(user, param)
-			if match:
-				return actionParam
-		return None
+			return "" # We'll handle the iteration
+		if user in channel.users:
+			return self.userBans(channel, user).get(mode)
+		return self.banMatcher(channel).matchAction(user, mode)
+	
+	def banMatcher(self, channel):
+		"""
+		Gets the compiled matcher for the channel's ban list, building it if the
+		ban list changed since it was last used.
+		"""
+		if "banmatcher" not in channel.cache:
+			channel.cache["banmatcher"] = ChannelBanMatcher(self, channel.modes["b"] if "b" in channel.modes else [])
+		return channel.cache["banmatcher"]
+	
+	def userBans(self, channel, user):
+		"""
+		Gets a dict of action extban to action parameter for every action with
+		a ban matching the user in the channel. For users in the channel, the
+		result is cached until the ban list or the user's hostmask changes.
+		"""
+		if user not in channel.users:
+			return self.banMatcher(channel).matchUser(user)
+		userData = channel.users[user]
+		if "bans" not in userData:
+			userData["bans"] = self.banMatcher(channel).matchUser(user)
+		return userData["bans"]
 	
 	def onChange(self, channel, source, adding, param):
-		if ";" in param:
-			actionExtban, banmask = param.split(";", 1)
-			if ":" in actionExtban:
-				actionExtban, actionParam = actionExtban.split(":", 1)
-			else:
-				actionParam = ""
-		else:
-			actionExtban= ""
-			actionParam = ""
-			banmask = param
-		if ":" in banmask and ("@" not in banmask or banmask.index(":") < banmask.index("@")):
-			matchingExtban, banmask = banmask.split(":", 1)
-			if matchingExtban and matchingExtban[0] == "~":
-				matchNegated = True
-				matchingExtban = matchingExtban[1:]
-			else:
-				matchNegated = False
-		else:
-			matchingExtban = ""
-			matchNegated = None
-		for user, cache in channel.users.iteritems():
-			if "bans" not in cache:
-				cache["bans"] = {}
-			if not (actionExtban in cache["bans"]) and not adding:
-				continue # If it didn't affect them before, it won't now, so let's skip the mongo processing we're about to do to them
-			if (actionExtban in cache["bans"]) and adding and actionParam == cache["bans"][actionExtban]:
-				continue
-			if matchingExtban:
-				matchesUser = self.ircd.runActionUntilTrue("usermatchban-{}".format(matchingExtban), user, matchNegated, banmask)
-			else:
-				matchesUser = self.matchHostmask(user, banmask)
-			if not matchesUser:
-				continue
-			if adding:
-				cache["bans"][actionExtban] = actionParam
-			else:
-				del cache["bans"][actionExtban]
+		self.clearChannelBanCache(channel)
+	
+	def clearChannelBanCache(self, channel):
+		if "banmatcher" in channel.cache:
+			del channel.cache["banmatcher"]
+		for cache in channel.users.itervalues():
+			if "bans" in cache:
+				del cache["bans"]
 	
 	def matchBans(self, user, channel):
-		if user in channel.users and "bans" in channel.users[user]:
-			return channel.users[user]["bans"]
 		if "b" in channel.modes:
-			matchesActions = {}
-			for paramData in channel.modes["b"]:
-				param = paramData[0]
-				actionExtban = ""
-				actionParam = ""
-				matchingExtban = ""
-				matchNegated = False
-				if ";" in param:
-					actionExtban, param = param.split(";", 1)
-					if ":" in actionExtban:
-						actionExtban, actionParam = actionExtban.split(":", 1)
-				if actionExtban in matchesActions:
-					continue
-				if ":" in param and ("@" not in param or param.find(":") < param.find("@")):
-					matchingExtban, param = param.split(":", 1)
-					if matchingExtban[0] == "~":
-						matchNegated = True
-						matchingExtban = matchingExtban[1:]
-				if matchingExtban:
-					if self.ircd.runActionUntilTrue("usermatchban-{}".format(matchingExtban), user, matchNegated, param):
-						matchesActions[actionExtban] = actionParam
-				else:
-					if self.matchHostmask(user, param):
-						matchesActions[""] = ""
-			return matchesActions
+			return self.userBans(channel, user)
 		return {}
 
 	def checkAutostatusPermission(self, channel, user, adding, param):
@@ -159,20 +130,7 @@ class BanMode(ModuleData, Mode):
 	def populateBanCache(self, channel, user):
 		if "b" not in channel.modes:
 			return
-		if "bans" not in channel.users[user]:
-			channel.users[user]["bans"] = {}
-		for paramData in channel.modes["b"]:
-			param = paramData[0]
-			actionExtban = ""
-			actionParam = ""
-			if ";" in param:
-				actionExtban, param = param.split(";", 1)
-				if ":" in actionExtban:
-					actionExtban, actionParam = actionExtban.split(":", 1)
-			if actionExtban in channel.users[user]["bans"]:
-				continue
-			if self.banMatchesUser(user, param):
-				channel.users[user]["bans"][actionExtban] = actionParam
+		channel.users[user]["bans"] = self.banMatcher(channel).matchUser(user)
 	
 	def autoStatus(self, channel, user):
 		if "bans" not in channel.users[user]:
@@ -189,6 +147,16 @@ class BanMode(ModuleData, Mode):
 			self.populateBanCache(channel, user)
 			self.autoStatus(channel, user)
 	
+	def clearUserBanCache(self, user, *params):
+		for channel in user.channels:
+			if "bans" in channel.users[user]:
+				del channel.users[user]["bans"]
+	
+	def clearBanCaches(self, moduleName):
+		# The module may have added or removed an extban matcher, so all ban lists need to be compiled again
+		for channel in self.ircd.channels.itervalues():
+			self.clearChannelBanCache(channel)
+	
 	def checkSet(self, channel, param):
 		actionExtban = ""
 		actionParam = ""
@@ -257,13 +225,9 @@ class BanMode(ModuleData, Mode):
 		# so we'll go straight to analyzing the ban list
 		if "b" not in channel.modes:
 			return None
-		for paramData in channel.modes["b"]:
-			param = paramData[0]
-			if ";" in param:
-				continue # Ignore entries with action extbans
-			if self.banMatchesUser(user, param):
-				user.sendMessage(irc.ERR_BANNEDFROMCHAN, channel.name, "Cannot join channel (You're banned)")
-				return False
+		if self.banMatcher(channel).matchAction(user, "") is not None: # Entries with action extbans are handled by their actions
+			user.sendMessage(irc.ERR_BANNEDFROMCHAN, channel.name, "Cannot join channel (You're banned)")
+			return False
 		return None
 	
 	def showListParams(self, user, channel):
@@ -274,4 +238,96 @@ class BanMode(ModuleData, Mode):
 			user.sendMessage(irc.RPL_BANLIST, channel.name, paramData[0], paramData[1], str(timestamp(paramData[2])))
 		user.sendMessage(irc.RPL_ENDOFBANLIST, channel.name, "End of channel ban list")
 
+def _parseBanmask(banmask):
+	"""
+	Splits the matching extban from a banmask. Returns a tuple of the matching
+	extban (or "" if there isn't one), whether the match is negated, and the
+	rest of the banmask.
+	"""
+	if ":" in banmask and ("@" not in banmask or banmask.find(":") < banmask.find("@")):
+		matchingExtban, banmask = banmask.split(":", 1)
+		if matchingExtban and matchingExtban[0] == "~":
+			return matchingExtban[1:], True, banmask
+		return matchingExtban, False, banmask
+	return "", False, banmask
+
+def _parseBan(param):
+	"""
+	Splits a ban list entry into a tuple of the action extban, the action
+	parameter, the matching extban, whether the match is negated, and the
+	banmask.
+	"""
+	actionExtban = ""
+	actionParam = ""
+	if ";" in param:
+		actionExtban, param = param.split(";", 1)
+		if ":" in actionExtban:
+			actionExtban, actionParam = actionExtban.split(":", 1)
+	matchingExtban, matchNegated, banmask = _parseBanmask(param)
+	return actionExtban, actionParam, matchingExtban, matchNegated, banmask
+
+def _hostmaskPattern(banmask):
+	pattern = translate(ircLower(banmask))
+	if pattern.endswith("\\Z(?ms)"): # Leave the end and flags for the combined expression
+		pattern = pattern[:-7]
+	return pattern
+
+class ChannelBanMatcher(object):
+	"""
+	Matches users against a channel's ban list. The list is parsed once and
+	grouped by action extban, and consecutive hostmask bans for the same action
+	and action parameter are compiled into one regular expression, so checking
+	a user against those bans is one match per hostmask form no matter how many
+	bans there are.
+	"""
+	def __init__(self, module, banList):
+		self._actionEntries = {} # Maps each action extban to a list of (action parameter, extban matching function or None for hostmasks, negated, banmask or compiled hostmask expression)
+		for paramData in banList:
+			actionExtban, actionParam, matchingExtban, matchNegated, banmask = _parseBan(paramData[0])
+			if actionExtban not in self._actionEntries:
+				self._actionEntries[actionExtban] = []
+			entries = self._actionEntries[actionExtban]
+			if matchingExtban:
+				matchFunction, banmask = module.extbanMatcher(matchingExtban, banmask)
+				entries.append((actionParam, matchFunction, matchNegated, banmask))
+			elif entries and entries[-1][1] is None and entries[-1][0] == actionParam:
+				entries[-1][3].append(_hostmaskPattern(banmask)) # Combine it with the hostmask bans before it
+			else:
+				entries.append((actionParam, None, False, [_hostmaskPattern(banmask)]))
+		for entries in self._actionEntries.itervalues():
+			for index, (actionParam, matchFunction, matchNegated, patterns) in enumerate(entries):
+				if matchFunction is None:
+					entries[index] = (actionParam, None, False, re.compile("(?:{})\\Z".format("|".join(patterns)), re.DOTALL | re.MULTILINE))
+	
+	def matchAction(self, user, actionExtban):
+		"""
+		Returns the action parameter of the first ban for the given action
+		extban that matches the user, or None if none of them match.
+		"""
+		if actionExtban not in self._actionEntries:
+			return None
+		hostmasks = None
+		for actionParam, matchFunction, matchNegated, banmask in self._actionEntries[actionExtban]:
+			if matchFunction is None:
+				if hostmasks is None:
+					hostmasks = (user.lowerHostmask(), user.lowerHostmaskWithRealHost(), user.lowerHostmaskWithIP())
+				for hostmask in hostmasks:
+					if banmask.match(hostmask):
+						return actionParam
+			elif matchFunction(user, matchNegated, banmask):
+				return actionParam
+		return None
+	
+	def matchUser(self, user):
+		"""
+		Returns a dict of action extban to action parameter for every action
+		with a ban matching the user.
+		"""
+		matchesActions = {}
+		for actionExtban in self._actionEntries:
+			actionParam = self.matchAction(user, actionExtban)
+			if actionParam is not None:
+				matchesActions[actionExtban] = actionParam
+		return matchesActions
+
 banMode = BanMode()
\ No newline at end of file
@@ -114,8 +114,8 @@ class UserInvite(Command):
 			tags = user.filterConditionalTags(conditionalTags)
 			targetUser.sendMessage("INVITE", channel.name, prefix=user.hostmask(), tags=tags)
 		notifyList = []
-		for chanUser in channel.users.iterkeys(): # Notify all users who can invite other users on the channel
-			if chanUser != user and chanUser != targetUser and chanUser.uuid[:3] == self.ircd.serverID and self.ircd.runActionUntilValue("checkchannellevel", "invite", channel, chanUser, users=[chanUser], channels=[channel]):
+		for chanUser in channel.localUsers: # Notify all users who can invite other users on the channel
+			if chanUser != user and chanUser != targetUser and self.ircd.runActionUntilValue("checkchannellevel", "invite", channel, chanUser, users=[chanUser], channels=[channel]):
 				notifyList.append(chanUser)
 		self.ircd.runActionProcessing("notifyinvite", notifyList, channel, user, targetUser)
 		self.ircd.runActionStandard("invite", user, targetUser, channel)
@@ -171,8 +171,8 @@ class ServerInvite(Command):
 			tags = user.filterConditionalTags(conditionalTags)
 			targetUser.sendMessage("INVITE", channel.name, prefix=user.hostmask(), tags=tags)
 		notifyList = []
-		for chanUser in channel.users.iterkeys():
-			if chanUser != user and chanUser != targetUser and chanUser.uuid[:3] == self.ircd.serverID and self.ircd.runActionUntilValue("checkchannellevel", "invite", channel, chanUser, users=[chanUser], channels=[channel]):
+		for chanUser in channel.localUsers:
+			if chanUser != user and chanUser != targetUser and self.ircd.runActionUntilValue("checkchannellevel", "invite", channel, chanUser, users=[chanUser], channels=[channel]):
 				notifyList.append(chanUser)
 		self.ircd.runActionProcessing("notifyinvite", notifyList, channel, user, targetUser)
 		self.ircd.runActionStandard("invite", user, targetUser, channel)
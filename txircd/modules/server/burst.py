@@ -24,19 +24,8 @@ class ServerBurst(ModuleData, Command):
 		for remoteServer in self.ircd.servers.itervalues():
 			if remoteServer == server:
 				continue
-			hopCount = 1
-			servTrace = remoteServer
-			if server == servTrace:
-				serversBurstingTo.append(remoteServer.serverID)
-				continue # Don't count this server
-			burstingRemote = False
-			while servTrace.nextClosest != self.ircd.serverID:
-				servTrace = self.ircd.servers[servTrace.nextClosest]
-				if server == servTrace:
-					burstingRemote = True
-					break
-				hopCount += 1
-			if burstingRemote:
+			nextHop, hopCount = self.ircd.serverRoutes[remoteServer.serverID]
+			if nextHop == server: # Don't count this server or servers behind it
 				serversBurstingTo.append(remoteServer.serverID)
 				continue
 			while len(serversByHopcount) < hopCount:
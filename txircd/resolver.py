@@ -0,0 +1,107 @@
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.threads import deferToThread
+from txircd.utils import isValidHost
+from collections import deque
+from socket import gaierror, gethostbyaddr, gethostbyname, herror
+from time import time
+
+def _resolveHost(ip):
+	"""
+	Looks up the hostname for an IP address. Runs in a thread, as the lookup
+	blocks.
+	Returns None if the IP doesn't resolve or the hostname doesn't resolve back
+	to the same IP.
+	"""
+	try:
+		resolvedHost = gethostbyaddr(ip)[0]
+		# First half of host resolution done, run second half to prevent rDNS spoofing.
+		if ip == gethostbyname(resolvedHost):
+			return resolvedHost
+	except (herror, gaierror):
+		pass
+	return None
+
+class HostResolver(object):
+	"""
+	Resolves the hostnames of connecting users without blocking the reactor.
+	Lookups are run in the reactor's thread pool with a limit on how many can
+	run at once, and their results, including failures, are cached by IP.
+	"""
+	def __init__(self, ircd):
+		self.ircd = ircd
+		self._cache = {}
+		self._waiting = {}
+		self._resolvingIPs = set()
+		self._queuedLookups = deque()
+		self._activeLookups = 0
+	
+	def lookupHost(self, ip):
+		"""
+		Looks up the hostname for an IP address.
+		Returns a Deferred that fires with the hostname, or with None if the
+		IP has no valid hostname or the lookup took too long.
+		"""
+		if ip in self._cache:
+			host, expireTime = self._cache[ip]
+			if expireTime > time():
+				return succeed(host)
+			del self._cache[ip]
+		resultDeferred = Deferred()
+		timeoutCall = reactor.callLater(self.ircd.config.get("dns_timeout", 5), self._timeOutLookup, ip, resultDeferred)
+		if ip in self._waiting:
+			self._waiting[ip].append((resultDeferred, timeoutCall))
+		else:
+			self._waiting[ip] = [(resultDeferred, timeoutCall)]
+		if ip in self._resolvingIPs:
+			return resultDeferred
+		self._resolvingIPs.add(ip)
+		if self._activeLookups < self.ircd.config.get("dns_concurrent_lookups", 10):
+			self._startLookup(ip)
+		else:
+			self._queuedLookups.append(ip)
+		return resultDeferred
+	
+	def _startLookup(self, ip):
+		self._activeLookups += 1
+		lookupDeferred = deferToThread(_resolveHost, ip)
+		lookupDeferred.addErrback(lambda failure: None)
+		lookupDeferred.addCallback(self._finishLookup, ip)
+	
+	def _finishLookup(self, host, ip):
+		self._activeLookups -= 1
+		self._resolvingIPs.discard(ip)
+		if host is not None and (len(host) > self.ircd.config.get("hostname_length", 64) or not isValidHost(host)):
+			host = None # Refuse hosts that are too long or invalid
+		if host is None:
+			cacheTime = self.ircd.config.get("dns_negative_cache_time", 300)
+		else:
+			cacheTime = self.ircd.config.get("dns_cache_time", 3600)
+		self._cache[ip] = (host, time() + cacheTime)
+		if ip in self._waiting:
+			for resultDeferred, timeoutCall in self._waiting.pop(ip):
+				if timeoutCall.active():
+					timeoutCall.cancel()
+					resultDeferred.callback(host)
+		while self._queuedLookups and self._activeLookups < self.ircd.config.get("dns_concurrent_lookups", 10):
+			queuedIP = self._queuedLookups.popleft()
+			if queuedIP in self._waiting:
+				self._startLookup(queuedIP)
+			else: # Skip lookups for which everyone waiting has timed out
+				self._resolvingIPs.discard(queuedIP)
+	
+	def _timeOutLookup(self, ip, resultDeferred):
+		if ip in self._waiting:
+			self._waiting[ip] = [waitData for waitData in self._waiting[ip] if waitData[0] is not resultDeferred]
+			if not self._waiting[ip]:
+				del self._waiting[ip]
+		resultDeferred.callback(None)
+	
+	def pruneCache(self):
+		"""
+		Removes expired entries from the cache.
+		"""
+		currentTime = time()
+		expiredIPs = [ip for ip, cacheData in self._cache.iteritems() if cacheData[1] <= currentTime]
+		for ip in expiredIPs:
+			del self._cache[ip]
\ No newline at end of file
@@ -1,6 +1,4 @@
-from twisted.internet import reactor
 from twisted.internet.defer import Deferred
-from twisted.internet.task import LoopingCall
 from txircd.ircbase import IRCBase
 from txircd.utils import now
 
@@ -16,10 +14,19 @@ class IRCServer(IRCBase):
 		self.bursted = None
 		self.disconnectedDeferred = Deferred()
 		self.receivedConnection = received
-		self._pinger = LoopingCall(self._ping)
-		self._registrationTimeoutTimer = reactor.callLater(self.ircd.config.get("server_registration_timeout", 10), self._timeoutRegistration)
+		self._pinger = None
+		self._registrationTimeoutTimer = self.ircd.timerWheel.callLater(self.ircd.config.get("server_registration_timeout", 10), self._timeoutRegistration)
+		self._outputBuffer = []
+		self._outputBufferSize = 0
+		self._outputFlushSize = self.ircd.config.get("output_flush_size", 16384)
 	
 	def handleCommand(self, command, params, prefix, tags):
+		if self.ircd.timingStats is not None and command in self.ircd.serverCommands:
+			self.ircd.timingStats.runTimedServerCommand(command, self._handleCommand, command, params, prefix, tags)
+		else:
+			self._handleCommand(command, params, prefix, tags)
+	
+	def _handleCommand(self, command, params, prefix, tags):
 		if command not in self.ircd.serverCommands:
 			self.disconnect("Unknown command {}".format(command)) # If we receive a command we don't recognize, abort immediately to avoid a desync
 			return
@@ -80,10 +87,10 @@ class IRCServer(IRCBase):
 		if self.serverID in self.ircd.servers:
 			if netsplitQuitMsg is None:
 				netsplitQuitMsg = "{} {}".format(self.ircd.servers[self.nextClosest].name if self.nextClosest in self.ircd.servers else self.ircd.name, self.name)
-			allUsers = self.ircd.users.values()
-			for user in allUsers:
-				if user.uuid[:3] == self.serverID:
+			if self.serverID in self.ircd.usersByServer:
+				for user in list(self.ircd.usersByServer[self.serverID]):
 					user.disconnect(netsplitQuitMsg, True)
+				del self.ircd.usersByServer[self.serverID]
 			allServers = self.ircd.servers.values()
 			for server in allServers:
 				if server.nextClosest == self.serverID:
@@ -91,19 +98,22 @@ class IRCServer(IRCBase):
 			self.ircd.recentlyQuitServers[self.serverID] = now()
 			del self.ircd.servers[self.serverID]
 			del self.ircd.serverNames[self.name]
+			del self.ircd.serverRoutes[self.serverID]
 		self.bursted = None
-		if self._pinger.running:
-			self._pinger.stop()
+		if self._pinger and self._pinger.active():
+			self._pinger.cancel()
 		if self._registrationTimeoutTimer.active():
 			self._registrationTimeoutTimer.cancel()
 		self._endConnection()
 	
 	def _endConnection(self):
+		self.flushOutput()
 		self.transport.loseConnection()
 	
 	def _timeoutRegistration(self):
 		if self.serverID and self.name:
-			self._pinger.start(self.ircd.config.get("server_ping_frequency", 60))
+			self._pinger = self.ircd.timerWheel.callRepeating(self.ircd.config.get("server_ping_frequency", 60), self._ping)
+			self._ping()
 			return
 		self.ircd.log.info("Disconnecting unregistered server")
 		self.disconnect("Registration timeout")
@@ -122,6 +132,11 @@ class IRCServer(IRCBase):
 			return
 		self.ircd.servers[self.serverID] = self
 		self.ircd.serverNames[self.name] = self.serverID
+		if self.nextClosest == self.ircd.serverID:
+			self.ircd.serverRoutes[self.serverID] = (self, 1)
+		else:
+			nextHop, hopCount = self.ircd.serverRoutes[self.nextClosest]
+			self.ircd.serverRoutes[self.serverID] = (nextHop, hopCount + 1)
 		self.ircd.runActionStandard("serverconnect", self)
 		if self.nextClosest != self.ircd.serverID:
 			self.bursted = True # Indicate that this server is fully connected and synced NOW since it's a remote server and we've either already gotten or are about to get all the interesting tidbits
@@ -138,10 +153,7 @@ class RemoteServer(IRCServer):
 		Messages sent this way should have some information in the contents so
 		that they can be propagated in the correct direction.
 		"""
-		target = self
-		while target.nextClosest != self.ircd.serverID:
-			target = self.ircd.servers[target.nextClosest]
-		target.sendMessage(command, *params, **kw)
+		self.ircd.serverRoutes[self.serverID][0].sendMessage(command, *params, **kw)
 	
 	def _endConnection(self):
 		pass
\ No newline at end of file
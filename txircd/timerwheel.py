@@ -0,0 +1,107 @@
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from math import ceil
+
+class TimerWheel(object):
+	"""
+	Schedules calls on a hashed timer wheel. Timers are placed in one of a fixed
+	number of slots based on the tick when they're due, and one periodic call
+	processes the slot for each tick, so the cost of keeping timers for many
+	connections doesn't depend on how many timers there are.
+	Calls are run up to one tick late, so this is only suitable for timers that
+	don't need to be precise, like pings and registration timeouts.
+	"""
+	def __init__(self, ircd, slotCount = 512, tickLength = 1):
+		self.ircd = ircd
+		self.tickLength = tickLength
+		self._slots = [set() for i in xrange(slotCount)]
+		self._currentTick = 0
+		self._startTime = reactor.seconds()
+		self._ticker = LoopingCall(self._tick)
+	
+	def start(self):
+		"""
+		Starts processing timers.
+		"""
+		self._startTime = reactor.seconds() - self._currentTick * self.tickLength
+		self._ticker.start(self.tickLength, False)
+	
+	def stop(self):
+		"""
+		Stops processing timers. Timers that are still scheduled are kept.
+		"""
+		if self._ticker.running:
+			self._ticker.stop()
+	
+	def callLater(self, delay, function, *args, **kw):
+		"""
+		Calls the given function with the given arguments after the given delay
+		(in seconds). Returns a TimerWheelCall which can be used to cancel the
+		call.
+		"""
+		timer = TimerWheelCall(None, function, args, kw)
+		self._schedule(timer, delay)
+		return timer
+	
+	def callRepeating(self, interval, function, *args, **kw):
+		"""
+		Calls the given function with the given arguments every interval
+		seconds, starting one interval from now, until the returned
+		TimerWheelCall is cancelled.
+		"""
+		timer = TimerWheelCall(interval, function, args, kw)
+		self._schedule(timer, interval)
+		return timer
+	
+	def _schedule(self, timer, delay):
+		tickCount = max(1, int(ceil(float(delay) / self.tickLength)))
+		timer.dueTick = self._currentTick + tickCount
+		timer.slot = self._slots[timer.dueTick % len(self._slots)]
+		timer.slot.add(timer)
+	
+	def _tick(self):
+		targetTick = int((reactor.seconds() - self._startTime) / self.tickLength)
+		while self._currentTick < targetTick:
+			self._currentTick += 1
+			slot = self._slots[self._currentTick % len(self._slots)]
+			dueTimers = [timer for timer in slot if timer.dueTick <= self._currentTick]
+			for timer in dueTimers:
+				slot.discard(timer)
+				timer.slot = None
+			for timer in dueTimers:
+				if timer.cancelled: # Cancelled by an earlier timer from this tick
+					continue
+				if timer.interval is not None:
+					self._schedule(timer, timer.interval)
+				try:
+					timer.function(*timer.args, **timer.kw)
+				except Exception:
+					self.ircd.log.failure("An error occurred while running a timed call.")
+
+class TimerWheelCall(object):
+	"""
+	A call scheduled on a TimerWheel.
+	"""
+	def __init__(self, interval, function, args, kw):
+		self.interval = interval
+		self.function = function
+		self.args = args
+		self.kw = kw
+		self.dueTick = None
+		self.slot = None
+		self.cancelled = False
+	
+	def active(self):
+		"""
+		Returns whether the call is still scheduled.
+		"""
+		return self.slot is not None
+	
+	def cancel(self):
+		"""
+		Cancels the call.
+		"""
+		self.cancelled = True
+		if self.slot is not None:
+			self.slot.discard(self)
+			self.slot = None
\ No newline at end of file
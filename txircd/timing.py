@@ -0,0 +1,135 @@
+from functools import partial
+from time import time
+
+class TimingStats(object):
+	"""
+	Collects call counts and wall time for actions, action handlers, and
+	commands. Every call is counted, but only one in every sampleRate calls of
+	each action or command is timed, so the overhead of leaving this enabled
+	can be kept low on busy servers.
+	Each set of stats is stored as a list of
+	[ calls, sampledCalls, totalSampledTime, maxSampledTime ]
+	"""
+	def __init__(self, sampleRate = 100):
+		self.sampleRate = sampleRate
+		self.actions = {}
+		self.handlers = {}
+		self.commands = {}
+		self.serverCommands = {}
+	
+	def _getStats(self, statsDict, key):
+		if key not in statsDict:
+			statsDict[key] = [0, 0, 0.0, 0.0]
+		return statsDict[key]
+	
+	def _shouldSample(self, stats):
+		stats[0] += 1
+		if stats[0] % self.sampleRate:
+			return False
+		stats[1] += 1
+		return True
+	
+	def timedFunctionList(self, actionName, functionList):
+		"""
+		Takes a list of (function, priority) tuples for an action. Counts the
+		action call and, if this call is sampled, returns a list with each
+		function wrapped to record its timing.
+		"""
+		actionStats = self._getStats(self.actions, actionName)
+		if not self._shouldSample(actionStats):
+			return functionList
+		callTime = [0.0]
+		return [(self._timedHandler(actionStats, callTime, action[0]), action[1]) for action in functionList]
+	
+	def timedComboFunctionList(self, actionNames, functionList):
+		"""
+		Takes a combined list of (actionName, function) tuples for a combo
+		action call and, like timedFunctionList, wraps the functions when this
+		call is sampled. The combination of actions is recorded as one action.
+		"""
+		actionStats = self._getStats(self.actions, "+".join(actionNames))
+		if not self._shouldSample(actionStats):
+			return functionList
+		callTime = [0.0]
+		return [(action[0], self._timedHandler(actionStats, callTime, action[1])) for action in functionList]
+	
+	def _timedHandler(self, actionStats, callTime, function):
+		handlerStats = self._getStats(self.handlers, handlerName(function))
+		def timedFunction(*params):
+			startTime = time()
+			try:
+				return function(*params)
+			finally:
+				elapsedTime = time() - startTime
+				handlerStats[0] += 1
+				handlerStats[1] += 1
+				self._addTime(handlerStats, elapsedTime)
+				# The action's time is the sum of the times of the handlers called for it
+				callTime[0] += elapsedTime
+				actionStats[2] += elapsedTime
+				if callTime[0] > actionStats[3]:
+					actionStats[3] = callTime[0]
+		return timedFunction
+	
+	def _addTime(self, stats, elapsedTime):
+		stats[2] += elapsedTime
+		if elapsedTime > stats[3]:
+			stats[3] = elapsedTime
+	
+	def runTimedCommand(self, commandName, commandFunction, *params):
+		"""
+		Calls the function handling a user command, counting the call and
+		timing it if it's sampled.
+		"""
+		self._runTimedCommand(self.commands, commandName, commandFunction, params)
+	
+	def runTimedServerCommand(self, commandName, commandFunction, *params):
+		"""
+		Calls the function handling a server command, counting the call and
+		timing it if it's sampled.
+		"""
+		self._runTimedCommand(self.serverCommands, commandName, commandFunction, params)
+	
+	def _runTimedCommand(self, statsDict, commandName, commandFunction, params):
+		commandStats = self._getStats(statsDict, commandName)
+		if not self._shouldSample(commandStats):
+			commandFunction(*params)
+			return
+		startTime = time()
+		try:
+			commandFunction(*params)
+		finally:
+			self._addTime(commandStats, time() - startTime)
+	
+	def report(self, maxEntries):
+		"""
+		Generates a report of the entries that have used the most time. Returns
+		a dict suitable for a STATS response.
+		"""
+		entries = []
+		for entryType, statsDict in (("action", self.actions), ("handler", self.handlers), ("command", self.commands), ("servercommand", self.serverCommands)):
+			for key, stats in statsDict.iteritems():
+				entries.append(("{}:{}".format(entryType, key), stats))
+		entries.sort(key=lambda entry: entry[1][2], reverse=True)
+		report = {}
+		for key, stats in entries[:maxEntries]:
+			calls, sampledCalls, totalTime, maxTime = stats
+			averageTime = totalTime / sampledCalls if sampledCalls else 0.0
+			report[key] = "calls={} sampled={} total={:.3f}ms avg={:.3f}ms max={:.3f}ms".format(calls, sampledCalls, totalTime * 1000, averageTime * 1000, maxTime * 1000)
+		return report
+
+def handlerName(function):
+	"""
+	Gets a name for an action handler consisting of the name of the module (or
+	the class of the object) providing it and the function name.
+	"""
+	if isinstance(function, partial): # Mode handlers are partials of the mode's apply function
+		function = function.func
+	functionName = getattr(function, "__name__", repr(function))
+	owner = getattr(function, "im_self", None)
+	if owner is None:
+		return functionName
+	ownerName = getattr(owner, "name", None)
+	if not isinstance(ownerName, basestring):
+		ownerName = owner.__class__.__name__
+	return "{}.{}".format(ownerName, functionName)
\ No newline at end of file
@@ -1,16 +1,19 @@
 from twisted.internet import reactor
 from twisted.internet.defer import Deferred
 from twisted.internet.interfaces import ISSLTransport
-from twisted.internet.task import LoopingCall
 from twisted.words.protocols import irc
 from txircd import version
 from txircd.ircbase import IRCBase
-from txircd.utils import CaseInsensitiveDictionary, isValidHost, isValidMetadataKey, ModeType, now, splitMessage
-from socket import gaierror, gethostbyaddr, gethostbyname, herror
+from txircd.utils import CaseInsensitiveDictionary, ircLower, isValidMetadataKey, ModeType, now, OrderedSet, splitMessage
 
 irc.ERR_ALREADYREGISTERED = "462"
 
+_noMetadata = CaseInsensitiveDictionary() # Shared by users without metadata until they get some; never modified
+
 class IRCUser(IRCBase):
+	localOnly = False
+	secureConnection = False
+	
 	def __init__(self, ircd, ip, uuid = None, host = None):
 		self.ircd = ircd
 		self.uuid = ircd.createUUID() if uuid is None else uuid
@@ -18,40 +21,48 @@ class IRCUser(IRCBase):
 		self.ident = None
 		if ip[0] == ":": # Normalize IPv6 address for IRC
 			ip = "0{}".format(ip)
-		if host is None:
-			try:
-				resolvedHost = gethostbyaddr(ip)[0]
-				# First half of host resolution done, run second half to prevent rDNS spoofing.
-				# Refuse hosts that are too long as well.
-				if ip == gethostbyname(resolvedHost) and len(resolvedHost) <= self.ircd.config.get("hostname_length", 64) and isValidHost(resolvedHost):
-					host = resolvedHost
-				else:
-					host = ip
-			except (herror, gaierror):
-				host = ip
+		resolveHost = host is None
+		if resolveHost:
+			host = ip # Use the IP until the host is resolved
 		self.realHost = host
 		self.ip = ip
 		self._hostStack = []
 		self._hostsByType = {}
+		self._hostmaskCache = {}
 		self.gecos = None
-		self._metadata = CaseInsensitiveDictionary()
+		self._metadata = _noMetadata
 		self.cache = {}
-		self.channels = []
+		self.channels = OrderedSet()
 		self.modes = {}
 		self.connectedSince = now()
 		self.nickSince = now()
 		self.idleSince = now()
 		self._registerHolds = set(("connection", "NICK", "USER"))
+		self.ircd.users[self.uuid] = self
+		if self.uuid[:3] not in self.ircd.usersByServer:
+			self.ircd.usersByServer[self.uuid[:3]] = set()
+		self.ircd.usersByServer[self.uuid[:3]].add(self)
+		self._initConnection(ip, resolveHost)
+	
+	def _initConnection(self, ip, resolveHost):
+		"""
+		Sets up the state used only by users connected to this server.
+		"""
+		self.ircd.localUsers[self.uuid] = self
+		self.ircd.localUserIndex.addUser(self)
 		self.disconnectedDeferred = Deferred()
 		self._messageBatches = {}
 		self._errorBatchName = None
 		self._errorBatch = []
-		self.ircd.users[self.uuid] = self
-		self.localOnly = False
-		self.secureConnection = False
-		self._pinger = LoopingCall(self._ping)
-		self._registrationTimeoutTimer = reactor.callLater(self.ircd.config.get("user_registration_timeout", 10), self._timeoutRegistration)
+		self._pinger = None
+		self._registrationTimeoutTimer = self.ircd.timerWheel.callLater(self.ircd.config.get("user_registration_timeout", 10), self._timeoutRegistration)
 		self._connectHandlerTimer = None
+		self._outputBuffer = []
+		self._outputBufferSize = 0
+		self._outputFlushSize = self.ircd.config.get("output_flush_size", 16384)
+		if resolveHost:
+			self._registerHolds.add("dns")
+			self.ircd.hostResolver.lookupHost(ip).addCallback(self._applyResolvedHost)
 	
 	def connectionMade(self):
 		# We need to callLater the connect action call because the connection isn't fully set up yet,
@@ -63,9 +74,19 @@ class IRCUser(IRCBase):
 		if ISSLTransport.providedBy(self.transport):
 			self.secureConnection = True
 	
+	def _applyResolvedHost(self, host):
+		if self.uuid not in self.ircd.users:
+			return # The user disconnected while we were resolving
+		if host is not None:
+			self.realHost = host
+			self._hostmaskCache.clear()
+			self.ircd.localUserIndex.updateUser(self)
+		self.register("dns")
+	
 	def _callConnectAction(self):
 		self._connectHandlerTimer = None
 		if self.ircd.runActionUntilFalse("userconnect", self, users=[self]):
+			self.flushOutput()
 			self.transport.loseConnection()
 		else:
 			self.register("connection")
@@ -97,6 +118,25 @@ class IRCUser(IRCBase):
 		    you might want some messages to always have the last parameter
 		    prefixed with a colon. To do that, pass this as True.
 		"""
+		args, kw = self._prepareMessage(command, args, kw)
+		IRCBase.sendMessage(self, command, *args, **kw)
+	
+	def sendCachedMessage(self, lineCache, command, *args, **kw):
+		"""
+		Sends the given message to this user in the same way as sendMessage.
+		Formatted lines are stored in the lineCache dict, and if the same line
+		was already formatted for another user, it's reused.
+		This allows sending a message to many users without formatting it for
+		each of them.
+		"""
+		args, kw = self._prepareMessage(command, args, kw)
+		tags = kw["tags"] if "tags" in kw else None
+		lineKey = (command, tuple(args), kw["prefix"] if "prefix" in kw else None, tuple(sorted(tags.iteritems())) if tags else None, "alwaysPrefixLastParam" in kw and kw["alwaysPrefixLastParam"])
+		if lineKey not in lineCache:
+			lineCache[lineKey] = self._formatMessage(command, args, kw)
+		self.sendLine(lineCache[lineKey])
+	
+	def _prepareMessage(self, command, args, kw):
 		if "prefix" not in kw:
 			kw["prefix"] = self.ircd.name
 		if kw["prefix"] is None:
@@ -107,10 +147,18 @@ class IRCUser(IRCBase):
 			del kw["to"]
 		if to:
 			args = [to] + list(args)
+		else:
+			args = list(args)
 		self.ircd.runActionStandard("modifyoutgoingmessage", self, command, args, kw)
-		IRCBase.sendMessage(self, command, *args, **kw)
+		return args, kw
 	
 	def handleCommand(self, command, params, prefix, tags):
+		if self.ircd.timingStats is not None and command in self.ircd.userCommands:
+			self.ircd.timingStats.runTimedCommand(command, self._handleCommand, command, params, prefix, tags)
+		else:
+			self._handleCommand(command, params, prefix, tags)
+	
+	def _handleCommand(self, command, params, prefix, tags):
 		if self.uuid not in self.ircd.users:
 			return # we have been disconnected - ignore all further commands
 		if command in self.ircd.userCommands:
@@ -244,8 +292,8 @@ class IRCUser(IRCBase):
 		"""
 		self.ircd.log.debug("Disconnecting user {user.uuid} ({user.hostmask()}): {reason}", user=self, reason=reason)
 		if self._pinger:
-			if self._pinger.running:
-				self._pinger.stop()
+			if self._pinger.active():
+				self._pinger.cancel()
 			self._pinger = None
 		if self._registrationTimeoutTimer:
 			if self._registrationTimeoutTimer.active():
@@ -256,22 +304,25 @@ class IRCUser(IRCBase):
 			self._connectHandlerTimer = None
 		self.ircd.recentlyQuitUsers[self.uuid] = now()
 		del self.ircd.users[self.uuid]
+		del self.ircd.localUsers[self.uuid]
+		self.ircd.localUserIndex.removeUser(self)
+		self.ircd.usersByServer[self.uuid[:3]].discard(self)
 		if self.isRegistered():
 			del self.ircd.userNicks[self.nick]
 		userSendList = [self]
-		while self.channels:
-			channel = self.channels[0]
-			userSendList.extend(channel.users.keys())
+		for channel in list(self.channels):
+			userSendList.extend(channel.localUsers)
 			self._leaveChannel(channel)
-		userSendList = [u for u in set(userSendList) if u.uuid[:3] == self.ircd.serverID]
+		userSendList = list(set(userSendList))
 		userSendList.remove(self)
 		self.ircd.runActionProcessing("quitmessage", userSendList, self, reason, users=[self] + userSendList)
 		self.ircd.runActionStandard("quit", self, reason, users=self)
+		self.flushOutput()
 		self.transport.loseConnection()
 	
 	def _timeoutRegistration(self):
 		if self.isRegistered():
-			self._pinger.start(self.ircd.config.get("user_ping_frequency", 60), False)
+			self._pinger = self.ircd.timerWheel.callRepeating(self.ircd.config.get("user_ping_frequency", 60), self._ping)
 			return
 		self.disconnect("Registration timeout")
 	
@@ -301,6 +352,7 @@ class IRCUser(IRCBase):
 				return
 			self._registerHolds.add("registercheck") # The user shouldn't be considered registered until we complete these final checks
 			if self.ircd.runActionUntilFalse("register", self, users=[self]):
+				self.flushOutput()
 				self.transport.loseConnection()
 				return
 			self._registerHolds.remove("registercheck")
@@ -338,21 +390,52 @@ class IRCUser(IRCBase):
 		"""
 		Returns the user's hostmask.
 		"""
-		return "{}!{}@{}".format(self.nick, self.ident, self.host())
+		if "hostmask" not in self._hostmaskCache:
+			self._hostmaskCache["hostmask"] = "{}!{}@{}".format(self.nick, self.ident, self.host())
+		return self._hostmaskCache["hostmask"]
 	
 	def hostmaskWithRealHost(self):
 		"""
 		Returns the user's hostmask using the user's real host rather than any
 		vhost that may have been applied.
 		"""
-		return "{}!{}@{}".format(self.nick, self.ident, self.realHost)
+		if "realhost" not in self._hostmaskCache:
+			self._hostmaskCache["realhost"] = "{}!{}@{}".format(self.nick, self.ident, self.realHost)
+		return self._hostmaskCache["realhost"]
 	
 	def hostmaskWithIP(self):
 		"""
 		Returns the user's hostmask using the user's IP address instead of the
 		host.
 		"""
-		return "{}!{}@{}".format(self.nick, self.ident, self.ip)
+		if "ip" not in self._hostmaskCache:
+			self._hostmaskCache["ip"] = "{}!{}@{}".format(self.nick, self.ident, self.ip)
+		return self._hostmaskCache["ip"]
+	
+	def lowerHostmask(self):
+		"""
+		Returns the user's hostmask lowercased for matching.
+		"""
+		if "lowerhostmask" not in self._hostmaskCache:
+			self._hostmaskCache["lowerhostmask"] = ircLower(self.hostmask())
+		return self._hostmaskCache["lowerhostmask"]
+	
+	def lowerHostmaskWithRealHost(self):
+		"""
+		Returns the user's hostmask with the real host lowercased for matching.
+		"""
+		if "lowerrealhost" not in self._hostmaskCache:
+			self._hostmaskCache["lowerrealhost"] = ircLower(self.hostmaskWithRealHost())
+		return self._hostmaskCache["lowerrealhost"]
+	
+	def lowerHostmaskWithIP(self):
+		"""
+		Returns the user's hostmask with the IP address lowercased for
+		matching.
+		"""
+		if "lowerip" not in self._hostmaskCache:
+			self._hostmaskCache["lowerip"] = ircLower(self.hostmaskWithIP())
+		return self._hostmaskCache["lowerip"]
 	
 	def changeNick(self, newNick, fromServer = None):
 		"""
@@ -367,13 +450,14 @@ class IRCUser(IRCBase):
 		if oldNick and oldNick in self.ircd.userNicks:
 			del self.ircd.userNicks[self.nick]
 		self.nick = newNick
+		self._hostmaskCache.clear()
 		self.nickSince = now()
 		if self.isRegistered():
 			self.ircd.userNicks[self.nick] = self.uuid
 			userSendList = [self]
 			for channel in self.channels:
-				userSendList.extend(channel.users.keys())
-			userSendList = [u for u in set(userSendList) if u.uuid[:3] == self.ircd.serverID]
+				userSendList.extend(channel.localUsers)
+			userSendList = list(set(userSendList))
 			self.ircd.runActionProcessing("changenickmessage", userSendList, self, oldNick, users=userSendList)
 			self.ircd.runActionStandard("changenick", self, oldNick, fromServer, users=[self])
 	
@@ -388,6 +472,8 @@ class IRCUser(IRCBase):
 			return
 		oldIdent = self.ident
 		self.ident = newIdent
+		self._hostmaskCache.clear()
+		self.ircd.localUserIndex.updateUser(self)
 		if self.isRegistered():
 			self.ircd.runActionStandard("changeident", self, oldIdent, fromServer, users=[self])
 	
@@ -412,6 +498,8 @@ class IRCUser(IRCBase):
 		if hostType in self._hostStack:
 			self._hostStack.remove(hostType)
 		self._hostStack.append(hostType)
+		self._hostmaskCache.clear()
+		self.ircd.localUserIndex.updateUser(self)
 		if self.isRegistered():
 			self.ircd.runComboActionStandard((("changehost", self, hostType, oldHost, fromServer), ("updatehost", self, hostType, oldHost, newHost, fromServer)), users=[self])
 	
@@ -435,6 +523,8 @@ class IRCUser(IRCBase):
 		if hostType in self._hostsByType:
 			oldHostOfType = self._hostsByType[hostType]
 		self._hostsByType[hostType] = newHost
+		self._hostmaskCache.clear()
+		self.ircd.localUserIndex.updateUser(self)
 		changedUserHost = (oldHost != self.host())
 		changedHostOfType = (oldHostOfType != newHost)
 		if self.isRegistered():
@@ -453,6 +543,8 @@ class IRCUser(IRCBase):
 		if hostType in self._hostStack:
 			self._hostStack.remove(hostType)
 		del self._hostsByType[hostType]
+		self._hostmaskCache.clear()
+		self.ircd.localUserIndex.updateUser(self)
 		currentHost = self.host()
 		if currentHost != oldHost:
 			self.ircd.runComboActionStandard((("changehost", self, hostType, oldHost, fromServer), ("updatehost", self, hostType, oldHost, None, fromServer)), users=[self])
@@ -549,6 +641,8 @@ class IRCUser(IRCBase):
 		elif not visibility:
 			return False
 		else:
+			if self._metadata is _noMetadata:
+				self._metadata = CaseInsensitiveDictionary()
 			self._metadata[key] = (key, value, visibility, setByUser)
 		oldValue = oldData[1] if oldData else None
 		self.ircd.runActionStandard("usermetadataupdate", self, key, oldValue, value, visibility, setByUser, fromServer, users=[self])
@@ -570,15 +664,17 @@ class IRCUser(IRCBase):
 			if self.ircd.runActionUntilValue("joinpermission", channel, self, users=[self], channels=[channel]) is False:
 				return
 		channel.users[self] = { "status": "" }
-		self.channels.append(channel)
+		channel.localUsers.add(self)
+		self.channels.add(channel)
 		newChannel = False
 		if channel.name not in self.ircd.channels:
 			newChannel = True
 			self.ircd.channels[channel.name] = channel
-			self.ircd.recentlyDestroyedChannels[channel.name] = False
+			if channel.name in self.ircd.recentlyDestroyedChannels:
+				del self.ircd.recentlyDestroyedChannels[channel.name]
 		# We need to send the JOIN message before doing other processing, as chancreate will do things like
 		# mode defaulting, which will send messages about the channel before the JOIN message, which is bad.
-		messageUsers = [u for u in channel.users.iterkeys() if u.uuid[:3] == self.ircd.serverID]
+		messageUsers = list(channel.localUsers)
 		self.ircd.runActionProcessing("joinmessage", messageUsers, channel, self, users=messageUsers, channels=[channel])
 		if newChannel:
 			self.ircd.runActionStandard("channelcreate", channel, self, channels=[channel])
@@ -593,7 +689,7 @@ class IRCUser(IRCBase):
 		"""
 		if channel not in self.channels:
 			return
-		messageUsers = [u for u in channel.users.iterkeys() if u.uuid[:3] == self.ircd.serverID]
+		messageUsers = list(channel.localUsers)
 		self.ircd.runActionProcessing("leavemessage", messageUsers, channel, self, partType, typeData, fromServer, users=[self], channels=[channel])
 		self._leaveChannel(channel)
 	
@@ -601,6 +697,11 @@ class IRCUser(IRCBase):
 		self.ircd.runActionStandard("leave", channel, self, users=[self], channels=[channel])
 		self.channels.remove(channel)
 		del channel.users[self]
+		channel.localUsers.discard(self)
+		if not channel.users:
+			self.ircd.runActionStandard("channeldestroy", channel, channels=[channel])
+			del self.ircd.channels[channel.name]
+			self.ircd.recentlyDestroyedChannels[channel.name] = now()
 	
 	def setModes(self, modes, defaultSource):
 		"""
@@ -813,11 +914,16 @@ class IRCUser(IRCBase):
 class RemoteUser(IRCUser):
 	def __init__(self, ircd, ip, uuid = None, host = None):
 		IRCUser.__init__(self, ircd, ip, uuid, host)
-		self._registrationTimeoutTimer.cancel()
+	
+	def _initConnection(self, ip, resolveHost):
+		pass # Remote users don't have a connection to this server.
 	
 	def sendMessage(self, command, *params, **kw):
 		pass # Messages can't be sent directly to remote users.
 	
+	def sendCachedMessage(self, lineCache, command, *params, **kw):
+		pass # Messages can't be sent directly to remote users.
+	
 	def register(self, holdName, fromRemote = False):
 		"""
 		Handles registration of a remote user.
@@ -844,12 +950,13 @@ class RemoteUser(IRCUser):
 				del self.ircd.userNicks[self.nick]
 			self.ircd.recentlyQuitUsers[self.uuid] = now()
 			del self.ircd.users[self.uuid]
+			if self.uuid[:3] in self.ircd.usersByServer:
+				self.ircd.usersByServer[self.uuid[:3]].discard(self)
 			userSendList = []
-			while self.channels:
-				channel = self.channels[0]
-				userSendList.extend(channel.users.keys())
+			for channel in list(self.channels):
+				userSendList.extend(channel.localUsers)
 				self._leaveChannel(channel)
-			userSendList = [u for u in set(userSendList) if u.uuid[:3] == self.ircd.serverID]
+			userSendList = list(set(userSendList))
 			self.ircd.runActionProcessing("quitmessage", userSendList, self, reason, users=userSendList)
 			self.ircd.runActionStandard("remotequit", self, reason, users=[self])
 		else:
@@ -865,12 +972,13 @@ class RemoteUser(IRCUser):
 		if self.nick and self.nick in self.ircd.userNicks and self.ircd.userNicks[self.nick] == self.uuid:
 			del self.ircd.userNicks[self.nick]
 		self.nick = newNick
+		self._hostmaskCache.clear()
 		self.ircd.userNicks[self.nick] = self.uuid
 		if self.isRegistered():
 			userSendList = [self]
 			for channel in self.channels:
-				userSendList.extend(channel.users.keys())
-			userSendList = [u for u in set(userSendList) if u.uuid[:3] == self.ircd.serverID]
+				userSendList.extend(channel.localUsers)
+			userSendList = list(set(userSendList))
 			self.ircd.runActionProcessing("changenickmessage", userSendList, self, oldNick, users=userSendList)
 			self.ircd.runActionStandard("remotechangenick", self, oldNick, fromServer, users=[self])
 	
@@ -883,6 +991,7 @@ class RemoteUser(IRCUser):
 			return
 		oldIdent = self.ident
 		self.ident = newIdent
+		self._hostmaskCache.clear()
 		if self.isRegistered():
 			self.ircd.runActionStandard("remotechangeident", self, oldIdent, fromServer, users=[self])
 	
@@ -908,9 +1017,16 @@ class RemoteUser(IRCUser):
 			if channel.name not in self.ircd.channels:
 				newChannel = True
 				self.ircd.channels[channel.name] = channel
+				if channel.name in self.ircd.recentlyDestroyedChannels:
+					del self.ircd.recentlyDestroyedChannels[channel.name]
 			channel.users[self] = { "status": "" }
-			self.channels.append(channel)
-			messageUsers = [u for u in channel.users.iterkeys() if u.uuid[:3] == self.ircd.serverID]
+			nextHop = self.ircd.serverRoutes[self.uuid[:3]][0]
+			if nextHop in channel.linkUserCounts:
+				channel.linkUserCounts[nextHop] += 1
+			else:
+				channel.linkUserCounts[nextHop] = 1
+			self.channels.add(channel)
+			messageUsers = list(channel.localUsers)
 			self.ircd.runActionProcessing("joinmessage", messageUsers, channel, self, users=[self], channels=[channel])
 			if newChannel:
 				self.ircd.runActionStandard("channelcreate", channel, self, channels=[channel])
@@ -922,6 +1038,14 @@ class RemoteUser(IRCUser):
 		self.ircd.runActionStandard("remoteleave", channel, self, users=[self], channels=[channel])
 		self.channels.remove(channel)
 		del channel.users[self]
+		nextHop = self.ircd.serverRoutes[self.uuid[:3]][0]
+		channel.linkUserCounts[nextHop] -= 1
+		if not channel.linkUserCounts[nextHop]:
+			del channel.linkUserCounts[nextHop]
+		if not channel.users:
+			self.ircd.runActionStandard("channeldestroy", channel, channels=[channel])
+			del self.ircd.channels[channel.name]
+			self.ircd.recentlyDestroyedChannels[channel.name] = now()
 
 class LocalUser(IRCUser):
 	"""
@@ -937,6 +1061,8 @@ class LocalUser(IRCUser):
 		self._pinger = None
 		self.nick = nick
 		self.ident = ident
+		self._hostmaskCache.clear()
+		self.ircd.localUserIndex.updateUser(self)
 		self.gecos = gecos
 		self.ircd.log.debug("Created new local user {user.uuid} ({user.hostmask()})", user=self)
 		self.ircd.runActionStandard("localregister", self, users=[self])
@@ -957,16 +1083,27 @@ class LocalUser(IRCUser):
 		"""
 		self._sendMsgFunc(self, command, *args, **kw)
 	
+	def sendCachedMessage(self, lineCache, command, *args, **kw):
+		"""
+		Sends a message to this user. Local users don't have a connection, so
+		there's no line to cache.
+		"""
+		self._sendMsgFunc(self, command, *args, **kw)
+	
 	def disconnect(self, reason):
 		"""
 		Cleans up and removes the user.
 		"""
 		del self.ircd.users[self.uuid]
+		del self.ircd.localUsers[self.uuid]
+		self.ircd.localUserIndex.removeUser(self)
+		self.ircd.usersByServer[self.uuid[:3]].discard(self)
 		del self.ircd.userNicks[self.nick]
 		userSendList = [self]
-		for channel in self.channels:
-			userSendList.extend(channel.users.keys())
-		userSendList = [u for u in set(userSendList) if u.uuid[:3] == self.ircd.serverID]
+		for channel in list(self.channels):
+			userSendList.extend(channel.localUsers)
+			self._leaveChannel(channel)
+		userSendList = list(set(userSendList))
 		userSendList.remove(self)
 		self.ircd.log.debug("Removing local user {user.uuid} ({user.hostmask()}): {reason}", user=self, reason=reason)
 		self.ircd.runActionProcessing("quitmessage", userSendList, self, reason, users=userSendList)
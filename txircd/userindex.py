@@ -0,0 +1,130 @@
+from txircd.utils import ircLower
+from bisect import bisect_left, insort
+
+_wildcardCharacters = "*?["
+
+def _literalPrefix(mask):
+	"""
+	Gets the part of a glob mask before its first wildcard.
+	"""
+	for index, character in enumerate(mask):
+		if character in _wildcardCharacters:
+			return mask[:index]
+	return mask
+
+def _keysWithPrefix(sortedKeys, prefix):
+	"""
+	Gets the keys in a sorted list of keys that start with the given prefix.
+	"""
+	keys = []
+	for index in xrange(bisect_left(sortedKeys, prefix), len(sortedKeys)):
+		if not sortedKeys[index].startswith(prefix):
+			break
+		keys.append(sortedKeys[index])
+	return keys
+
+def _removeSorted(sortedKeys, key):
+	index = bisect_left(sortedKeys, key)
+	if index < len(sortedKeys) and sortedKeys[index] == key:
+		del sortedKeys[index]
+
+class LocalUserIndex(object):
+	"""
+	Indexes the users connected to this server by ident and by host (the
+	displayed host, the real host, and the IP address, lowercased with
+	ircLower), so that the users who could match a mask can be found without
+	checking every user.
+	Hosts are also kept sorted both forward and reversed, so masks that start
+	(like 192.0.2.*) or end (like *.example.com) with literal text only look
+	at the hosts that start or end that way.
+	"""
+	def __init__(self):
+		self._userKeys = {}
+		self._usersByIdent = {}
+		self._usersByHost = {}
+		self._sortedHosts = []
+		self._sortedReversedHosts = []
+	
+	def addUser(self, user):
+		"""
+		Adds a user to the index.
+		"""
+		identKey = None if user.ident is None else ircLower(user.ident)
+		hostKeys = set((ircLower(user.host()), ircLower(user.realHost), ircLower(user.ip)))
+		self._userKeys[user] = (identKey, hostKeys)
+		if identKey is not None:
+			if identKey not in self._usersByIdent:
+				self._usersByIdent[identKey] = set()
+			self._usersByIdent[identKey].add(user)
+		for hostKey in hostKeys:
+			if hostKey not in self._usersByHost:
+				self._usersByHost[hostKey] = set()
+				insort(self._sortedHosts, hostKey)
+				insort(self._sortedReversedHosts, hostKey[::-1])
+			self._usersByHost[hostKey].add(user)
+	
+	def removeUser(self, user):
+		"""
+		Removes a user from the index.
+		"""
+		if user not in self._userKeys:
+			return
+		identKey, hostKeys = self._userKeys.pop(user)
+		if identKey is not None:
+			identUsers = self._usersByIdent[identKey]
+			identUsers.discard(user)
+			if not identUsers:
+				del self._usersByIdent[identKey]
+		for hostKey in hostKeys:
+			hostUsers = self._usersByHost[hostKey]
+			hostUsers.discard(user)
+			if not hostUsers:
+				del self._usersByHost[hostKey]
+				_removeSorted(self._sortedHosts, hostKey)
+				_removeSorted(self._sortedReversedHosts, hostKey[::-1])
+	
+	def updateUser(self, user):
+		"""
+		Reindexes a user after a change to the user's ident or hosts. Users who
+		aren't in the index are ignored.
+		"""
+		if user in self._userKeys:
+			self.removeUser(user)
+			self.addUser(user)
+	
+	def usersWithHost(self, host):
+		"""
+		Returns a set of the users with the given lowercased host as their
+		displayed host, real host, or IP address.
+		"""
+		if host not in self._usersByHost:
+			return set()
+		return set(self._usersByHost[host])
+	
+	def candidateUsers(self, identMask, hostMask):
+		"""
+		Returns a set of the users who could match the given ident and host glob
+		masks, which should be lowercased with ircLower. An identMask of None
+		matches any ident. Every user matching the masks is included, but not
+		every user included matches.
+		"""
+		hostPrefix = _literalPrefix(hostMask)
+		if hostPrefix == hostMask:
+			return self.usersWithHost(hostMask)
+		if identMask is not None and _literalPrefix(identMask) == identMask:
+			if identMask not in self._usersByIdent:
+				return set()
+			return set(self._usersByIdent[identMask])
+		hostSuffix = ""
+		if "[" not in hostMask: # The end of a character class would look like literal text when reversed
+			hostSuffix = _literalPrefix(hostMask[::-1])
+		users = set()
+		if len(hostSuffix) > len(hostPrefix):
+			for reversedHost in _keysWithPrefix(self._sortedReversedHosts, hostSuffix):
+				users.update(self._usersByHost[reversedHost[::-1]])
+		elif hostPrefix:
+			for host in _keysWithPrefix(self._sortedHosts, hostPrefix):
+				users.update(self._usersByHost[host])
+		else:
+			users.update(self._userKeys)
+		return users
\ No newline at end of file
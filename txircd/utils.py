@@ -1,5 +1,6 @@
-from collections import MutableMapping
+from collections import MutableMapping, MutableSet
 from datetime import datetime
+from string import ascii_lowercase, ascii_uppercase, maketrans
 import re
 
 validNick = re.compile(r"^[a-zA-Z\-\[\]\\`^{}_|][a-zA-Z0-9\-\[\]\\^{}_|]*$")
@@ -41,31 +42,56 @@ def _enum(**enums):
 ModeType = _enum(List=0, ParamOnUnset=1, Param=2, NoParam=3, Status=4)
 
 
+_ircLowerTable = maketrans(ascii_uppercase + "[]\\", ascii_lowercase + "{}|")
+_ircLowerUnicodeTable = { ord("["): u"{", ord("]"): u"}", ord("\\"): u"|" }
 def ircLower(string):
 	"""
 	Lowercases a string according to RFC lowercasing standards.
 	"""
-	return string.lower().replace("[", "{").replace("]", "}").replace("\\", "|")
+	if isinstance(string, unicode):
+		return string.lower().translate(_ircLowerUnicodeTable)
+	return string.translate(_ircLowerTable)
+
+_lowerKeyCache = {}
+_lowerKeyCacheSize = 8192
+def _ircLowerKey(key):
+	"""
+	Lowercases a key for a CaseInsensitiveDictionary. The same keys (nicks,
+	channel names) are looked up over and over, so the results for recently
+	used keys are kept.
+	"""
+	lowerKey = _lowerKeyCache.get(key)
+	if lowerKey is None:
+		lowerKey = ircLower(key)
+		if len(_lowerKeyCache) >= _lowerKeyCacheSize:
+			_lowerKeyCache.clear() # The keys that are actually in use will be added back quickly
+		_lowerKeyCache[key] = lowerKey
+	return lowerKey
 
 class CaseInsensitiveDictionary(MutableMapping):
 	"""
 	It's a dictionary with RFC-case-insensitive keys.
 	"""
+	__slots__ = ("_data",)
+
 	def __init__(self, dictType = dict):
 		self._data = dictType()
 
 	def __repr__(self):
 		return repr(self._data)
 
+	def __contains__(self, key):
+		return _ircLowerKey(key) in self._data
+
 	def __delitem__(self, key):
 		try:
-			del self._data[ircLower(key)]
+			del self._data[_ircLowerKey(key)]
 		except KeyError:
 			raise KeyError(key)
 
 	def __getitem__(self, key):
 		try:
-			return self._data[ircLower(key)]
+			return self._data[_ircLowerKey(key)]
 		except KeyError:
 			raise KeyError(key)
 
@@ -76,7 +102,70 @@ class CaseInsensitiveDictionary(MutableMapping):
 		return len(self._data)
 
 	def __setitem__(self, key, value):
-		self._data[ircLower(key)] = value
+		self._data[_ircLowerKey(key)] = value
+
+
+_removedItem = object()
+
+class OrderedSet(MutableSet):
+	"""
+	It's a set that remembers the order in which items were added.
+	Items are kept in a list in the order they were added. Removing an item
+	leaves a gap in the list, and the gaps are cleared out once there are
+	more gaps than items, so adding and removing items are O(1) (amortized)
+	and iteration is linear.
+	"""
+	__slots__ = ("_indices", "_items", "_firstIndex") # There are a lot of these (one for each user), so keep them small
+
+	def __init__(self, iterable = ()):
+		self._indices = {}
+		self._items = []
+		self._firstIndex = 0 # Skips the gaps at the start of the list, so the first item can be found quickly
+		for item in iterable:
+			self.add(item)
+
+	def __repr__(self):
+		return "{}({!r})".format(self.__class__.__name__, list(self))
+
+	def __contains__(self, item):
+		return item in self._indices
+
+	def __iter__(self):
+		items = self._items
+		for index in xrange(self._firstIndex, len(items)):
+			item = items[index]
+			if item is not _removedItem:
+				yield item
+
+	def __len__(self):
+		return len(self._indices)
+
+	def add(self, item):
+		if item not in self._indices:
+			self._indices[item] = len(self._items)
+			self._items.append(item)
+
+	def discard(self, item):
+		if item not in self._indices:
+			return
+		items = self._items
+		index = self._indices.pop(item)
+		if not self._indices:
+			self._items = []
+			self._firstIndex = 0
+			return
+		items[index] = _removedItem
+		if index == len(items) - 1:
+			while items[-1] is _removedItem:
+				items.pop()
+		elif index == self._firstIndex:
+			while items[self._firstIndex] is _removedItem:
+				self._firstIndex += 1
+		if len(items) > 2 * len(self._indices):
+			self._items = [item for item in items if item is not _removedItem]
+			for index, item in enumerate(self._items):
+				self._indices[item] = index
+			self._firstIndex = 0
 
 
 def now():